@@ -1,14 +1,26 @@
 import logging
 import asyncio
 import os
-from datetime import datetime, timezone, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ChatMemberUpdated
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ChatMemberHandler
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
+from itertools import count, islice
+from datetime import datetime, timezone
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, ChatMemberUpdated, InputMediaPhoto, InputMediaVideo
+from telegram.ext import AIORateLimiter, Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ChatMemberHandler
 from telegram.constants import ChatType
+from telegram.request import HTTPXRequest
 from telegram.error import Forbidden, BadRequest
+from aiolimiter import AsyncLimiter
+import orjson
+from diskcache import Cache, Disk, Index
+from diskcache.core import UNKNOWN
 from dotenv import load_dotenv
-import secrets
+import base64
 import re
+import functools
+import heapq
 
 load_dotenv()
 
@@ -23,62 +35,489 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 MAIN_ADMIN_ID = int(os.environ.get('MAIN_ADMIN_ID', '0'))
 FILE_DELETE_SECONDS = 15  # Default
+STATE_DIR = os.environ.get('STATE_DIR', 'state')  # Where users, admins, links and channels are persisted
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # Public HTTPS base URL; long polling is used when unset
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')  # Optional secret Telegram sends with every update
+WEBHOOK_PATH = 'telegram'  # Updates are POSTed to WEBHOOK_URL/WEBHOOK_PATH
+PORT = int(os.environ.get('PORT', '8443'))  # Webhook listen port (set by Railway)
+MEDIA_GROUP_MAX = 10  # Telegram's album size limit for sendMediaGroup
+DELETE_MESSAGES_MAX = 100  # Telegram's per-call limit for deleteMessages
+FILE_CODE_BYTES = 8  # 8 random bytes -> 11 char URL-safe link codes, so "redownload_<code>" fits callback_data
+
+# Public channel link, e.g. https://t.me/channelname
+TME_USERNAME_RE = re.compile(r't\.me/([a-zA-Z0-9_]+)')
+
+# Chat member statuses that count as joined
+MEMBER_STATUSES = frozenset({'member', 'administrator', 'creator'})
+MEMBERSHIP_CACHE_SECONDS = 60  # How long a verified membership is trusted
+MEMBERSHIP_CACHE_MAX = 100_000  # Sweep expired entries above this size
+
+# Anti-spam: more than SPAM_MAX_REQUESTS within SPAM_WINDOW_SECONDS blocks the user
+SPAM_WINDOW_SECONDS = 5
+SPAM_MAX_REQUESTS = 3
+SPAM_BLOCK_SECONDS = 30
+SPAM_TRACKED_USERS_MAX = 10_000  # Least recently seen unblocked users are forgotten beyond this
+SPAM_ALERT_REPEAT_SECONDS = 2  # The same alert to the same user within this long is answered silently
+
+MAX_DOWNLOAD_RECORDS = 10_000  # Oldest download records are dropped beyond this
+MAX_FILE_LINKS = 100_000  # Oldest file links are deleted beyond this
+EXPIRY_BATCH_SECONDS = 0.1  # Expiries due within this window are processed together
+MAX_MESSAGE_MAP = 50_000  # Forwarded messages older than this can no longer be replied to
+
+# Telegram flood limits, enforced for every Bot API call by AIORateLimiter
+API_MAX_RATE_PER_SECOND = 30
+GROUP_MAX_RATE_PER_MINUTE = 20
+API_MAX_RETRIES = 1  # Retry once when Telegram answers with RetryAfter
+
+# Broadcast: concurrent sends (the rate limiter keeps them under the flood limit)
+BROADCAST_CONCURRENCY = API_MAX_RATE_PER_SECOND  # Enough in-flight sends to keep the limiter saturated
+BROADCAST_WORKERS = 1  # Broadcasts run one after another so each chat gets them in order
+
+# Bot API connection pool: sized for broadcast and membership-check fan-out, multiplexed over HTTP/2
+HTTP_POOL_SIZE = 100
+HTTP_TIMEOUT_SECONDS = 30
+HTTP_POOL_TIMEOUT_SECONDS = 5  # How long a call may wait for a free pooled connection
+
+# Message templates, filled with str.format_map
+ADMIN_WELCOME_TEMPLATE = (
+    "👋 سلام {name}!\n\n"
+    "✨ شما ادمین هستید. برای آپلود فایل، عکس یا ویدیو را ارسال کنید.\n\n"
+    "📝 می‌توانید چند فایل پشت سر هم ارسال کنید و یک لینک واحد دریافت کنید.\n\n"
+    "💬 برای پاسخ به پیام کاربران، روی پیام آن‌ها Reply کنید.\n\n"
+    "از دکمه‌های زیر برای مدیریت بات استفاده کنید:"
+)
+USER_WELCOME_TEMPLATE = (
+    "👋 سلام {name}\n\n"
+    "برای دریافت فایل‌ها، لینک را از ادمین دریافت کنید.\n\n"
+    "یا می‌توانید از دکمه زیر برای ارتباط با مدیر استفاده کنید:"
+)
+LINK_CREATED_TEMPLATE = (
+    "✅ لینک فایل با موفقیت ساخته شد!\n\n"
+    "🔗 لینک: {share_link}\n\n"
+    "📦 تعداد فایل‌ها: {file_count}\n"
+    "📝 متن: {caption}\n"
+    "⏱️ زمان حذف: {delete_seconds} ثانیه\n\n"
+    "این لینک را برای کاربران ارسال کنید."
+)
+
+# Static keyboards, built once and shared (Telegram objects are immutable)
+ADMIN_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("👥 کاربران"), KeyboardButton("📁 فایل‌ها")],
+    [KeyboardButton("📨 ارسال PM"), KeyboardButton("🔒 جوین اجباری")],
+    [KeyboardButton("📢 ارسال پست به کانال")]
+], resize_keyboard=True)
+MAIN_ADMIN_KEYBOARD = ReplyKeyboardMarkup([
+    [KeyboardButton("👥 کاربران"), KeyboardButton("📁 فایل‌ها")],
+    [KeyboardButton("📨 ارسال PM"), KeyboardButton("🔒 جوین اجباری")],
+    [KeyboardButton("📢 ارسال پست به کانال")],
+    [KeyboardButton("👤 مدیریت ادمین‌ها")]
+], resize_keyboard=True)
+CONTACT_ADMIN_ROW = [InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]
+CONTACT_ADMIN_MARKUP = InlineKeyboardMarkup([CONTACT_ADMIN_ROW])
+CANCEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]])
+NO_POST_CAPTION_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🚫 بدون متن", callback_data="no_post_caption")]])
+NO_USER_CAPTION_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🚫 بدون توضیحات", callback_data="no_user_caption")]])
+NO_CAPTION_FILES_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🚫 بدون متن", callback_data="no_caption_files")]])
+MORE_FILES_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ بله، فایل دیگری هم دارم", callback_data="add_more_files")],
+    [InlineKeyboardButton("❌ نه، تمام شد", callback_data="finish_files")],
+    [InlineKeyboardButton("🗑 لغو و پاک کردن همه", callback_data="cancel_upload")]
+])
+ADD_ADMIN_ROW = [InlineKeyboardButton("➕ افزودن ادمین جدید", callback_data="add_new_admin")]
+
+# Admin inline menus
+USERS_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👥 کاربران فعال", callback_data="menu_active_users")],
+    [InlineKeyboardButton("👤 جستجوی کاربر", callback_data="menu_search_user")],
+    [InlineKeyboardButton("🔨 بلاک کاربر", callback_data="menu_block_user")],
+    [InlineKeyboardButton("✅ آنبلاک کاربر", callback_data="menu_unblock_user")]
+])
+FILES_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 لیست فایل‌ها", callback_data="menu_list_files")],
+    [InlineKeyboardButton("🗑 حذف لینک فایل", callback_data="menu_delete_file")]
+])
+PM_MENU_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📤 ارسال همگانی", callback_data="menu_broadcast")],
+    [InlineKeyboardButton("📩 پیام به کاربر", callback_data="menu_pm_user")]
+])
+# Force join menu rows; the detected-channels row is spliced in after the first one when needed
+FORCE_JOIN_MENU_ROWS = (
+    [InlineKeyboardButton("📢 کانال‌های اجباری", callback_data="menu_list_channels")],
+    [InlineKeyboardButton("➕ افزودن کانال", callback_data="menu_add_channel")],
+    [InlineKeyboardButton("➖ حذف کانال", callback_data="menu_remove_channel")]
+)
+FORCE_JOIN_MENU_MARKUP = InlineKeyboardMarkup(FORCE_JOIN_MENU_ROWS)
+
+def format_timestamp(timestamp: float) -> str:
+    """Render an epoch timestamp for admin listings"""
+    if not timestamp:
+        return 'نامشخص'
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+@functools.lru_cache(maxsize=2048)
+def _make_redownload_markup(file_code: str) -> InlineKeyboardMarkup:
+    """Redownload + contact keyboard, shared by every user of the same link"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 دریافت مجدد محتوا", callback_data=f"redownload_{file_code}")],
+        CONTACT_ADMIN_ROW
+    ])
+
+class OrjsonDisk(Disk):
+    """diskcache serializer storing values as orjson instead of pickle (keys are unchanged)"""
+    def store(self, value, read, key=UNKNOWN):
+        if not read:
+            value = orjson.dumps(value)
+        return super().store(value, read, key=key)
+    
+    def fetch(self, mode, filename, value, read):
+        data = super().fetch(mode, filename, value, read)
+        return data if read else orjson.loads(data)
+
+_DELETED = object()  # queued in place of a value to remove a key from a store
+
+def open_store(name: str) -> Index:
+    """Open a persistent mapping under STATE_DIR"""
+    return Index.fromcache(Cache(os.path.join(STATE_DIR, name), eviction_policy='none', disk=OrjsonDisk))
+
+def clears_state(handler):
+    """Clear the conversation state in user_data once the handler finishes"""
+    @functools.wraps(handler)
+    async def wrapper(self, update, context, *args, **kwargs):
+        try:
+            return await handler(self, update, context, *args, **kwargs)
+        finally:
+            context.user_data.clear()
+    return wrapper
+
+@dataclass(slots=True)
+class FileInfo:
+    """A share link: one or more uploaded files sent together"""
+    files: list  # [{'file_type': 'photo'|'video', 'telegram_file_id': ...}, ...]
+    caption: str | None = None
+    delete_seconds: int = FILE_DELETE_SECONDS
+    created_at: float = 0.0  # Epoch seconds
+    admin_id: int = 0
+
+class TokenPool:
+    """URL-safe random tokens sliced from a buffer filled by one os.urandom call"""
+    def __init__(self, token_bytes: int, buffer_size: int = 4096):
+        self.token_bytes = token_bytes
+        self.buffer_size = buffer_size - buffer_size % token_bytes
+        self._buffer = b''
+        self._offset = 0
+    
+    def next_token(self) -> str:
+        """Return the next token, refilling the buffer when it runs out"""
+        if self._offset + self.token_bytes > len(self._buffer):
+            self._buffer = os.urandom(self.buffer_size)
+            self._offset = 0
+        chunk = self._buffer[self._offset:self._offset + self.token_bytes]
+        self._offset += self.token_bytes
+        return base64.urlsafe_b64encode(chunk).rstrip(b'=').decode('ascii')
+
+@dataclass(slots=True)
+class UserInfo:
+    """A user who has started the bot"""
+    user_id: int
+    username: str = 'unknown'
+    first_name: str = 'unknown'
+    is_blocked: bool = False
+    is_bot_blocked: bool = False
+    last_seen: float = 0.0  # Epoch seconds, formatted only when displayed
+    blocked_at: float | None = None  # Epoch seconds
+    bot_blocked_at: float | None = None
+
+@dataclass(slots=True)
+class PendingUserFile:
+    """A photo/video a user sent for the admins, held until they add or skip a caption"""
+    file_type: str  # 'photo' | 'video'
+    telegram_file_id: str
+
+@dataclass(slots=True)
+class SpamInfo:
+    """Per-user leaky bucket and the end of their temporary block"""
+    # The bucket admits SPAM_MAX_REQUESTS - 1 requests, so the SPAM_MAX_REQUESTS-th one inside the window is blocked
+    limiter: AsyncLimiter = field(default_factory=lambda: AsyncLimiter(SPAM_MAX_REQUESTS - 1, SPAM_WINDOW_SECONDS))
+    blocked_until: float = 0.0
 
 class TelegramBot:
+    # Exact-match callbacks that belong to the admin upload/post flows
+    _ADMIN_ONLY_ACTIONS = frozenset({
+        'no_post_caption', 'add_more_files', 'finish_files', 'cancel_upload', 'no_caption_files',
+    })
+    
     def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .request(HTTPXRequest(
+                connection_pool_size=HTTP_POOL_SIZE,
+                read_timeout=HTTP_TIMEOUT_SECONDS,
+                write_timeout=HTTP_TIMEOUT_SECONDS,
+                pool_timeout=HTTP_POOL_TIMEOUT_SECONDS,
+                http_version="2",
+            ))
+            .get_updates_request(HTTPXRequest(http_version="2"))
+            .rate_limiter(AIORateLimiter(
+                overall_max_rate=API_MAX_RATE_PER_SECOND,
+                overall_time_period=1,
+                group_max_rate=GROUP_MAX_RATE_PER_MINUTE,
+                group_time_period=60,
+                max_retries=API_MAX_RETRIES,
+            ))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         self.bot = self.application.bot
-        
-        # In-memory storage (instead of MongoDB)
-        self.users = {}  # user_id -> user_info
-        self.admins = {MAIN_ADMIN_ID: {'username': 'main_admin', 'added_at': datetime.now(timezone.utc).isoformat()}}
-        self.files = {}  # unique_code -> file_info (can contain multiple files)
+        self._background_tasks = set()  # long-running asyncio tasks started in post_init
+        self.bot_username = None  # set once in post_init for share links
+        self._store_writer_task = None  # started in post_init, drained in post_shutdown
+        self._tokens = TokenPool(FILE_CODE_BYTES)  # link codes
+        
+        # Persistent storage on disk; the dicts below are the in-memory working set,
+        # and every change to them is queued for _store_writer to write through
+        self._stores = {name: open_store(name) for name in ('users', 'admins', 'files', 'channels')}
+        self._pending_writes = {}  # store name -> {key: value or _DELETED}, latest write wins
+        self._writes_event = asyncio.Event()  # set when _pending_writes has something to flush
+        self._closing = False  # tells _store_writer to exit once everything is flushed
+        
+        self.users = {}  # user_id -> UserInfo
+        self._active_user_ids = set()  # not blocked by admin and not blocked the bot
+        self._blocked_user_ids = set()  # blocked by admin
+        self.admins = {}  # admin_id -> admin_info
+        self._admin_ids = frozenset()  # snapshot of self.admins keys for is_admin
+        self.files = {}  # unique_code -> FileInfo (can contain multiple files)
         self.mandatory_channels = {}  # channel_identifier -> channel_info (with button_text)
-        self.spam_control = {}  # user_id -> spam_info
-        self.user_message_map = {}  # message_id -> user_id (for admin replies)
-        self.downloads = []  # list of download records
-        self.user_channel_memberships = {}  # user_id -> {channel_key: True/False}
+        self._channel_list_text = None  # cached "menu_list_channels" text, reset when channels change
+        self.spam_control = OrderedDict()  # user_id -> SpamInfo, least recently seen first
+        self._last_alerts = {}  # (user_id, alert text) -> monotonic time it was last shown
+        self.user_message_map = OrderedDict()  # message_id -> user_id (for admin replies), oldest first
+        self.downloads = deque(maxlen=MAX_DOWNLOAD_RECORDS)  # (file_code, user_id, downloaded_at) tuples
+        self.user_channel_memberships = {}  # user_id -> bitmask of joined channels (see _channel_bits)
+        self._channel_bits = {}  # channel_key -> single-bit mask, never reused after removal
+        self._next_channel_bit = 0
+        self._required_channel_mask = 0  # OR of the bits of all current mandatory channels
+        self.membership_cache = {}  # (user_id, chat_id) -> (status, expires_at) for verified members
         self.detected_channels = {}  # chat_id -> channel_info (auto-detected when bot becomes admin)
+        self.broadcast_queue = asyncio.Queue()  # (admin_id, message_text) jobs for _broadcast_worker
+        self._expiry_heap = []  # (deadline, seq, chat_id, message_ids, delay_seconds, file_code) for _expiry_worker
+        self._expiry_seq = count()  # tie-breaker so heap entries never compare past the deadline
+        self._expiry_event = asyncio.Event()  # set when a new expiry is scheduled
+        self._expiry_batches = set()  # in-flight _expiry_worker batches, referenced until done
+        
+        # callback_data -> handler for buttons without a payload
+        self._cb_handlers = {
+            'contact_admin': self._cb_contact_admin,
+            'no_post_caption': self._cb_no_post_caption,
+            'add_new_admin': self._cb_add_new_admin,
+            'add_more_files': self._cb_add_more_files,
+            'finish_files': self._cb_finish_files,
+            'cancel_upload': self._cb_cancel_upload,
+            'no_caption_files': self._cb_no_caption_files,
+            'cancel_user_send': self._cb_cancel_user_send,
+            'no_user_caption': self._cb_no_user_caption,
+        }
+        
+        # callback_data prefix -> handler taking the rest of the data as payload
+        self._cb_prefix_handlers = (
+            ('viewhist_', self._cb_viewhist),
+            ('select_channel_', self._cb_select_channel),
+            ('autoadd_', self._cb_autoadd),
+            ('autostore_', self._cb_autostore),
+            ('autoignore_', self._cb_autoignore),
+            ('removeadmin_', self._cb_removeadmin),
+            ('delchan_', self._cb_delchan),
+            ('delfile_', self._cb_delfile),
+            ('unblock_', self._cb_unblock),
+            ('redownload_', self._cb_redownload),
+            ('check_', self._cb_check),
+        )
+        
+        # awaiting state -> handler for the admin/user text flows
+        self._text_handlers = {
+            'broadcast_message': self._text_broadcast_message,
+            'search_user_id': self._text_search_user_id,
+            'user_caption_to_admin': self._text_user_caption_to_admin,
+            'post_caption': self._text_post_caption,
+            'post_url': self._text_post_url,
+            'post_button_text': self._text_post_button_text,
+            'caption_for_files': self._text_caption_for_files,
+            'delete_time': self._text_delete_time,
+            'channel_link': self._text_channel_link,
+            'channel_button_text': self._text_channel_button_text,
+            'auto_channel_button_text': self._text_auto_channel_button_text,
+            'target_user_id': self._text_target_user_id,
+            'pm_message': self._text_pm_message,
+            'block_user_id': self._text_block_user_id,
+            'new_admin_id': self._text_new_admin_id,
+        }
+        
+        self._load_state()
+    
+    def _load_state(self):
+        """Load persisted records into the in-memory working set"""
+        for user_id, user_info in self._stores['users'].items():
+            self.users[user_id] = UserInfo(**user_info) if isinstance(user_info, dict) else user_info
+            self._index_user(user_id)
+        
+        self.admins.update(self._stores['admins'].items())
+        self._admin_ids = frozenset(self.admins)
+        if MAIN_ADMIN_ID not in self.admins:
+            self.save_admin(MAIN_ADMIN_ID, {'username': 'main_admin', 'added_at': time.time()})
+        
+        for file_code, file_info in self._stores['files'].items():
+            # Records come back from JSON as plain dicts
+            self.files[file_code] = FileInfo(**file_info) if isinstance(file_info, dict) else file_info
+        self._evict_old_files()
+        
+        for channel_key, channel_info in self._stores['channels'].items():
+            self.add_mandatory_channel(channel_key, channel_info)
+        
+        logger.info(
+            "Loaded state from %s: %s users, %s admins, %s links, %s channels",
+            STATE_DIR, len(self.users), len(self.admins), len(self.files), len(self.mandatory_channels)
+        )
+    
+    def _queue_write(self, store_name: str, key, value):
+        """Queue a store write (or _DELETED to remove the key) for _store_writer"""
+        self._pending_writes.setdefault(store_name, {})[key] = value
+        self._writes_event.set()
+    
+    def _flush_writes(self, pending: dict):
+        """Apply queued writes with one transaction per store (runs in a worker thread)"""
+        for store_name, writes in pending.items():
+            store = self._stores[store_name]
+            with store.transact():
+                for key, value in writes.items():
+                    if value is _DELETED:
+                        store.pop(key, None)
+                    else:
+                        store[key] = value
+    
+    async def _store_writer(self):
+        """Write queued changes to disk off the event loop, batching whatever piled up meanwhile"""
+        while True:
+            await self._writes_event.wait()
+            self._writes_event.clear()
+            pending, self._pending_writes = self._pending_writes, {}
+            if pending:
+                try:
+                    await asyncio.to_thread(self._flush_writes, pending)
+                except Exception as e:
+                    logger.error("Error persisting %s: %s", list(pending), e)
+            if self._closing and not self._pending_writes:
+                return
+    
+    def save_user(self, user_id: int):
+        """Re-index and persist a user's record after it changed"""
+        self._index_user(user_id)
+        self._queue_write('users', user_id, self.users[user_id])
+    
+    def save_admin(self, admin_id: int, admin_info: dict):
+        """Add or update an admin"""
+        self.admins[admin_id] = admin_info
+        self._queue_write('admins', admin_id, admin_info)
+        self._admin_ids = self._admin_ids | {admin_id}
+    
+    def remove_admin(self, admin_id: int):
+        """Remove an admin"""
+        del self.admins[admin_id]
+        self._queue_write('admins', admin_id, _DELETED)
+        self._admin_ids = self._admin_ids - {admin_id}
+    
+    def save_file(self, file_code: str, file_info: FileInfo):
+        """Store a file link"""
+        self.files[file_code] = file_info
+        self._queue_write('files', file_code, file_info)
+        self._evict_old_files()
+    
+    def remove_file(self, file_code: str) -> bool:
+        """Delete a file link, returning False if it did not exist"""
+        if self.files.pop(file_code, None) is None:
+            return False
+        self._queue_write('files', file_code, _DELETED)
+        return True
+    
+    def _evict_old_files(self):
+        """Delete the oldest links once there are more than MAX_FILE_LINKS"""
+        excess = len(self.files) - MAX_FILE_LINKS
+        if excess <= 0:
+            return
+        # self.files is in creation order
+        for file_code in list(islice(self.files, excess)):
+            self.remove_file(file_code)
+        logger.info("Evicted %s oldest file links", excess)
         
     def is_admin(self, user_id: int) -> bool:
         """Check if user is admin"""
-        return user_id in self.admins
+        return user_id in self._admin_ids
     
-    def get_admin_keyboard(self):
-        """Create admin reply keyboard"""
-        keyboard = [
-            [KeyboardButton("👥 کاربران"), KeyboardButton("📁 فایل‌ها")],
-            [KeyboardButton("📨 ارسال PM"), KeyboardButton("🔒 جوین اجباری")],
-            [KeyboardButton("📢 ارسال پست به کانال")]
-        ]
-        return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    def get_admin_keyboard(self, user_id: int = None):
+        """Admin reply keyboard (main admin also gets admin management)"""
+        if user_id == MAIN_ADMIN_ID:
+            return MAIN_ADMIN_KEYBOARD
+        return ADMIN_KEYBOARD
+    
+    def get_user_keyboard(self, file_code: str = None):
+        """User inline keyboard, with a redownload button when file_code is given"""
+        if file_code is None:
+            return CONTACT_ADMIN_MARKUP
+        return _make_redownload_markup(file_code)
     
     async def mark_user_blocked_bot(self, user_id: int):
         """Mark that user has blocked the bot"""
-        if user_id in self.users:
-            self.users[user_id]['is_bot_blocked'] = True
-            self.users[user_id]['bot_blocked_at'] = datetime.now(timezone.utc).isoformat()
-            logger.info(f"User {user_id} marked as blocked bot")
+        user_info = self.users.get(user_id)
+        if user_info is not None:
+            user_info.is_bot_blocked = True
+            user_info.bot_blocked_at = time.time()
+            self.save_user(user_id)
+            logger.info("User %s marked as blocked bot", user_id)
     
     async def mark_user_unblocked_bot(self, user_id: int):
         """Mark that user has unblocked the bot"""
-        if user_id in self.users:
-            self.users[user_id]['is_bot_blocked'] = False
-            self.users[user_id].pop('bot_blocked_at', None)
-            logger.info(f"User {user_id} marked as unblocked bot")
+        user_info = self.users.get(user_id)
+        if user_info is not None:
+            user_info.is_bot_blocked = False
+            user_info.bot_blocked_at = None
+            self.save_user(user_id)
+            logger.info("User %s marked as unblocked bot", user_id)
     
     def get_user_downloads(self, user_id: int) -> list:
         """Get all downloads by a specific user"""
-        user_downloads = [d for d in self.downloads if d['user_id'] == user_id]
+        user_downloads = [d for d in self.downloads if d[1] == user_id]
         return user_downloads
     
-    def get_active_users(self) -> list:
-        """Get list of active users (not blocked by admin, not blocked bot)"""
-        active_users = [
-            u for u in self.users.values() 
-            if not u.get('is_blocked', False) and not u.get('is_bot_blocked', False)
-        ]
-        return active_users
+    def _download_to_dict(self, download: tuple) -> dict:
+        """Expand a download record for display"""
+        file_code, user_id, downloaded_at = download
+        file_group = self.files.get(file_code)
+        if file_group:
+            caption = (file_group.caption or 'بدون متن')[:50]
+            file_count = len(file_group.files)
+        else:
+            caption = '🗑 لینک حذف شده'
+            file_count = 0
+        return {
+            'file_code': file_code,
+            'user_id': user_id,
+            'downloaded_at': datetime.fromtimestamp(downloaded_at, timezone.utc),
+            'file_count': file_count,
+            'caption': caption
+        }
+    
+    def _index_user(self, user_id: int):
+        """Keep the active/blocked id sets in sync with the user's record"""
+        user_info = self.users[user_id]
+        if user_info.is_blocked:
+            self._blocked_user_ids.add(user_id)
+        else:
+            self._blocked_user_ids.discard(user_id)
+        
+        if not user_info.is_blocked and not user_info.is_bot_blocked:
+            self._active_user_ids.add(user_id)
+        else:
+            self._active_user_ids.discard(user_id)
     
     async def get_chat_id_from_link(self, link: str):
         """Try to get actual chat_id from a link by calling getChat"""
@@ -93,7 +532,7 @@ class TelegramBot:
             
             # For public channels, extract username
             if 't.me/' in link:
-                match = re.search(r't\.me/([a-zA-Z0-9_]+)', link)
+                match = TME_USERNAME_RE.search(link)
                 if match:
                     username = '@' + match.group(1)
                     chat = await self.bot.get_chat(chat_id=username)
@@ -101,7 +540,7 @@ class TelegramBot:
             
             return None
         except Exception as e:
-            logger.warning(f"Cannot get chat_id from link {link}: {e}")
+            logger.warning("Cannot get chat_id from link %s: %s", link, e)
             return None
     
     def extract_channel_info(self, text: str) -> dict:
@@ -133,7 +572,7 @@ class TelegramBot:
                 }
             # Public link: https://t.me/channelname
             else:
-                match = re.search(r't\.me/([a-zA-Z0-9_]+)', text)
+                match = TME_USERNAME_RE.search(text)
                 if match:
                     username = '@' + match.group(1)
                     return {
@@ -144,7 +583,7 @@ class TelegramBot:
                     }
         
         # Check if it's a numeric chat_id
-        if text.lstrip('-').isdigit():
+        if text.lstrip('-').isdecimal():
             return {
                 'type': 'chat_id',
                 'identifier': int(text),
@@ -160,8 +599,6 @@ class TelegramBot:
         Returns: (is_admin, chat_id or None, invite_link or None)
         """
         try:
-            bot_info = await self.bot.get_me()
-            
             # Try to get chat info first
             chat = None
             chat_id = None
@@ -175,7 +612,7 @@ class TelegramBot:
                         chat = await self.bot.get_chat(chat_id=channel_identifier)
                         chat_id = chat.id
                     except Exception as e:
-                        logger.warning(f"Cannot get chat for {channel_identifier}: {e}")
+                        logger.warning("Cannot get chat for %s: %s", channel_identifier, e)
                         return False, None, None
                 else:
                     # It's a link - try to extract username or use detected channels
@@ -195,7 +632,7 @@ class TelegramBot:
             # Check if bot is admin
             member = await self.bot.get_chat_member(
                 chat_id=chat_id,
-                user_id=bot_info.id
+                user_id=self.bot.id
             )
             is_admin = member.status in ['administrator', 'creator']
             
@@ -203,14 +640,14 @@ class TelegramBot:
             if is_admin and not invite_link:
                 try:
                     invite_link = await self.bot.export_chat_invite_link(chat_id=chat_id)
-                    logger.info(f"Got invite link for chat {chat_id}: {invite_link}")
+                    logger.info("Got invite link for chat %s: %s", chat_id, invite_link)
                 except Exception as e:
-                    logger.warning(f"Cannot export invite link for {chat_id}: {e}")
+                    logger.warning("Cannot export invite link for %s: %s", chat_id, e)
             
             return is_admin, chat_id, invite_link
             
         except Exception as e:
-            logger.warning(f"Cannot check if bot is admin in {channel_identifier}: {e}")
+            logger.warning("Cannot check if bot is admin in %s: %s", channel_identifier, e)
             return False, None, None
     
     async def check_membership(self, user_id: int, force_recheck: bool = False) -> tuple[bool, list]:
@@ -218,86 +655,77 @@ class TelegramBot:
         if not self.mandatory_channels:
             return True, []
         
-        # Initialize user membership tracking if not exists
-        if user_id not in self.user_channel_memberships:
-            self.user_channel_memberships[user_id] = {}
+        memberships = self.user_channel_memberships.get(user_id, 0)
         
-        not_joined = []
+        # If force_recheck is True, reset membership status
+        if force_recheck:
+            memberships &= ~self._required_channel_mask
+        
+        # Collect channels the bot can verify itself (bot is admin there)
+        auto_channels = []
         for channel_key, channel_info in self.mandatory_channels.items():
-            try:
-                # Get the actual chat_id to check
-                chat_id = channel_info.get('chat_id') or channel_info.get('identifier')
-                can_auto_verify = channel_info.get('can_auto_verify', False)
-                
-                # If force_recheck is True, reset membership status
-                if force_recheck:
-                    self.user_channel_memberships[user_id][channel_key] = False
-                
-                # Check if we already verified this user for this channel
-                if self.user_channel_memberships[user_id].get(channel_key) and not force_recheck:
-                    # Already verified via trust or auto-verify - but let's recheck if auto-verify
-                    if can_auto_verify and chat_id and isinstance(chat_id, int):
-                        # Recheck to see if user left
-                        try:
-                            member = await self.bot.get_chat_member(
-                                chat_id=chat_id,
-                                user_id=user_id
-                            )
-                            if member.status not in ['member', 'administrator', 'creator']:
-                                # User left, mark as not joined
-                                self.user_channel_memberships[user_id][channel_key] = False
-                                not_joined.append(channel_info)
-                                logger.info(f"User {user_id} left channel {channel_key}")
-                            else:
-                                # Still member
-                                continue
-                        except Exception as e:
-                            logger.warning(f"Cannot recheck membership for {chat_id}: {e}")
-                            # Cannot verify, add to not_joined
-                            self.user_channel_memberships[user_id][channel_key] = False
-                            not_joined.append(channel_info)
-                    else:
-                        # Trust-based, assume still member unless force_recheck
-                        continue
-                else:
-                    # Not verified yet or force_recheck - do verification
-                    if can_auto_verify and chat_id and isinstance(chat_id, int):
-                        try:
-                            member = await self.bot.get_chat_member(
-                                chat_id=chat_id,
-                                user_id=user_id
-                            )
-                            if member.status in ['member', 'administrator', 'creator']:
-                                # Mark as verified
-                                self.user_channel_memberships[user_id][channel_key] = True
-                                logger.info(f"User {user_id} verified automatically in {chat_id}")
-                            else:
-                                # Not joined or kicked
-                                self.user_channel_memberships[user_id][channel_key] = False
-                                not_joined.append(channel_info)
-                        except Exception as e:
-                            logger.warning(f"Cannot auto-check membership for {chat_id}: {e}")
-                            # Cannot verify, add to not_joined
-                            if not self.user_channel_memberships[user_id].get(channel_key):
-                                not_joined.append(channel_info)
-                    else:
-                        # Bot is not admin - trust-based after user confirms
-                        if not self.user_channel_memberships[user_id].get(channel_key):
-                            not_joined.append(channel_info)
-                    
-            except Exception as e:
-                logger.error(f"Error checking membership for channel {channel_key}: {e}")
-                if not self.user_channel_memberships[user_id].get(channel_key):
-                    not_joined.append(channel_info)
+            chat_id = channel_info.get('chat_id') or channel_info.get('identifier')
+            if channel_info.get('can_auto_verify', False) and chat_id and isinstance(chat_id, int):
+                auto_channels.append((self._channel_bits[channel_key], chat_id))
+        
+        # Reuse recently verified memberships, only ask Telegram about the rest
+        now = time.monotonic()
+        to_fetch = []
+        for bit, chat_id in auto_channels:
+            cached = self.membership_cache.get((user_id, chat_id))
+            if cached and cached[1] > now:
+                memberships |= bit
+            else:
+                to_fetch.append((bit, chat_id))
+        
+        results = await asyncio.gather(
+            *(self.bot.get_chat_member(chat_id=chat_id, user_id=user_id) for _, chat_id in to_fetch),
+            return_exceptions=True
+        )
+        for (bit, chat_id), member in zip(to_fetch, results):
+            if isinstance(member, Exception):
+                logger.warning("Cannot check membership for %s: %s", chat_id, member)
+                memberships &= ~bit
+            elif member.status in MEMBER_STATUSES:
+                if not memberships & bit:
+                    logger.info("User %s verified automatically in %s", user_id, chat_id)
+                self.cache_membership(user_id, chat_id, member.status)
+                memberships |= bit
+            else:
+                if memberships & bit:
+                    logger.info("User %s left channel %s", user_id, chat_id)
+                memberships &= ~bit
+        
+        self.user_channel_memberships[user_id] = memberships
         
-        return len(not_joined) == 0, not_joined
+        required = self._required_channel_mask
+        if memberships & required == required:
+            return True, []
+        
+        # Bot is not admin - trust-based channels keep the bit set when the user confirms
+        not_joined = [
+            channel_info for channel_key, channel_info in self.mandatory_channels.items()
+            if not memberships & self._channel_bits[channel_key]
+        ]
+        return False, not_joined
+    
+    def cache_membership(self, user_id: int, chat_id: int, status: str):
+        """Remember a verified membership for MEMBERSHIP_CACHE_SECONDS"""
+        now = time.monotonic()
+        if len(self.membership_cache) >= MEMBERSHIP_CACHE_MAX:
+            # Drop expired entries before growing further
+            self.membership_cache = {
+                key: value for key, value in self.membership_cache.items() if value[1] > now
+            }
+            if len(self.membership_cache) >= MEMBERSHIP_CACHE_MAX:
+                self.membership_cache.clear()
+        self.membership_cache[(user_id, chat_id)] = (status, now + MEMBERSHIP_CACHE_SECONDS)
     
     def mark_user_joined_channel(self, user_id: int, channel_key: str):
         """Mark that user has joined a channel (trust-based)"""
-        if user_id not in self.user_channel_memberships:
-            self.user_channel_memberships[user_id] = {}
-        self.user_channel_memberships[user_id][channel_key] = True
-        logger.info(f"User {user_id} marked as joined channel {channel_key} (trust-based)")
+        bit = self._channel_bits.get(channel_key, 0)
+        self.user_channel_memberships[user_id] = self.user_channel_memberships.get(user_id, 0) | bit
+        logger.info("User %s marked as joined channel %s (trust-based)", user_id, channel_key)
     
     def get_channel_url(self, channel_info: dict) -> str:
         """Convert channel info to a valid URL"""
@@ -319,85 +747,239 @@ class TelegramBot:
         # Default: return as is
         return display
     
-    async def schedule_message_deletion_and_send_buttons(self, chat_id: int, message_ids: list, delay_seconds: int, file_code: str = None):
-        """Delete messages after specified seconds and send buttons"""
-        await asyncio.sleep(delay_seconds)
+    def add_mandatory_channel(self, channel_key: str, channel_info: dict):
+        """Register a mandatory channel, resolving its join URL once"""
+        channel_info['join_url'] = self.get_channel_url(channel_info)
+        self.mandatory_channels[channel_key] = channel_info
+        self._channel_list_text = None
+        self._queue_write('channels', channel_key, channel_info)
+        if channel_key not in self._channel_bits:
+            self._channel_bits[channel_key] = 1 << self._next_channel_bit
+            self._next_channel_bit += 1
+        self._required_channel_mask |= self._channel_bits[channel_key]
+    
+    def remove_mandatory_channel(self, channel_key: str) -> dict:
+        """Unregister a mandatory channel and return its info"""
+        channel_info = self.mandatory_channels.pop(channel_key)
+        self._channel_list_text = None
+        self._queue_write('channels', channel_key, _DELETED)
+        self._required_channel_mask &= ~self._channel_bits.pop(channel_key, 0)
+        return channel_info
+    
+    def _render_channel_list(self) -> str:
+        """Mandatory channel list text, rebuilt only after the channels change"""
+        if self._channel_list_text is None:
+            lines = [f"📢 کانال‌های عضویت اجباری ({len(self.mandatory_channels)} عدد):\n\n"]
+            for idx, ch_info in enumerate(self.mandatory_channels.values(), 1):
+                verify_mode = "✅ چک خودکار" if ch_info.get('can_auto_verify') else "🤝 بر اساس اعتماد"
+                lines.append(f"{idx}. {ch_info['button_text']}\n")
+                lines.append(f"   🔗 {ch_info['display']}\n")
+                if ch_info.get('invite_link'):
+                    lines.append(f"   📎 {ch_info['invite_link']}\n")
+                lines.append(f"   🔍 {verify_mode}\n\n")
+            self._channel_list_text = "".join(lines)
+        return self._channel_list_text
+    
+    def _render_blocked_users(self, header: str, footer: str = '') -> tuple[str, InlineKeyboardMarkup]:
+        """First 20 blocked users as text plus one unblock button each"""
+        blocked_count = len(self._blocked_user_ids)
+        lines = [header]
+        keyboard = []
+        
+        for u in (self.users[uid] for uid in islice(self._blocked_user_ids, 20)):
+            lines.append(f"• {u.first_name} (@{u.username}) - ID: {u.user_id}\n")
+            keyboard.append([InlineKeyboardButton(
+                f"✅ آنبلاک: {u.first_name} ({u.user_id})", 
+                callback_data=f"unblock_{u.user_id}"
+            )])
         
-        try:
-            # Delete all messages
-            for message_id in message_ids:
-                try:
-                    await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
-                    logger.info(f"Message {message_id} deleted from chat {chat_id} after {delay_seconds} seconds")
-                except Exception as e:
-                    logger.error(f"Error deleting message {message_id}: {e}")
+        if blocked_count > 20:
+            lines.append(f"\n... و {blocked_count - 20} نفر دیگر")
+        
+        lines.append(footer)
+        return "".join(lines), InlineKeyboardMarkup(keyboard)
+    
+    def _render_file_delete_menu(self, header: str, footer: str = '') -> tuple[str, InlineKeyboardMarkup]:
+        """First 15 file links as text plus one delete button each"""
+        lines = [header]
+        keyboard = []
+        
+        for idx, (code, file_info) in enumerate(self.files.items(), 1):
+            file_count = len(file_info.files)
+            caption = file_info.caption or 'بدون متن'
+            if len(caption) > 20:
+                caption = caption[:20] + "..."
+            
+            lines.append(f"{idx}. {code} ({file_count} فایل)\n")
+            keyboard.append([InlineKeyboardButton(f"🗑 حذف: {code} - {caption}", callback_data=f"delfile_{code}")])
+            
+            if idx >= 15:
+                lines.append(f"\n... و {len(self.files) - 15} لینک دیگر\n")
+                break
+        
+        lines.append(footer)
+        return "".join(lines), InlineKeyboardMarkup(keyboard)
+    
+    def _render_channel_delete_menu(self, header: str, footer: str = '') -> tuple[str, InlineKeyboardMarkup]:
+        """Mandatory channels as text plus one remove button each"""
+        lines = [header]
+        keyboard = []
+        
+        for idx, (ch_key, ch_info) in enumerate(self.mandatory_channels.items(), 1):
+            lines.append(f"{idx}. {ch_info['button_text']}\n   🔗 {ch_info['display']}\n\n")
+            keyboard.append([InlineKeyboardButton(f"🗑 حذف: {ch_info['button_text']}", callback_data=f"delchan_{ch_key}")])
+        
+        lines.append(footer)
+        return "".join(lines), InlineKeyboardMarkup(keyboard)
+    
+    def _build_join_markup(self, not_joined_channels: list, file_code: str) -> InlineKeyboardMarkup:
+        """Build the join-channels keyboard with a final "joined" check button"""
+        # Always use URL button (no callback) - direct link
+        keyboard = [
+            [InlineKeyboardButton(channel['button_text'], url=channel.get('join_url') or self.get_channel_url(channel))]
+            for channel in not_joined_channels
+        ]
+        keyboard.append([InlineKeyboardButton(
+            "✅ عضو شدم",
+            callback_data=f"check_{file_code}"
+        )])
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def _delete_messages_quietly(self, chat_id: int, message_ids: list):
+        """Delete messages in deleteMessages batches, logging instead of raising on failure"""
+        for start in range(0, len(message_ids), DELETE_MESSAGES_MAX):
+            batch = message_ids[start:start + DELETE_MESSAGES_MAX]
+            try:
+                await self.bot.delete_messages(chat_id=chat_id, message_ids=batch)
+            except Exception as e:
+                logger.error("Error deleting messages %s: %s", batch, e)
+    
+    def schedule_message_deletion_and_send_buttons(self, chat_id: int, message_ids: list, delay_seconds: int, file_code: str = None):
+        """Queue messages for deletion after specified seconds"""
+        deadline = time.monotonic() + delay_seconds
+        heapq.heappush(self._expiry_heap, (deadline, next(self._expiry_seq), chat_id, message_ids, delay_seconds, file_code))
+        self._expiry_event.set()
+    
+    async def _expiry_worker(self):
+        """Delete expired messages and send redownload buttons as they come due"""
+        while True:
+            if not self._expiry_heap:
+                self._expiry_event.clear()
+                await self._expiry_event.wait()
+                continue
             
-            # Send only redownload button
-            keyboard = []
-            if file_code:
-                keyboard.append([InlineKeyboardButton("🔄 دریافت مجدد محتوا", callback_data=f"redownload_{file_code}")])
+            wait = self._expiry_heap[0][0] - time.monotonic()
+            if wait > 0:
+                # Wake early if a sooner deadline gets scheduled
+                self._expiry_event.clear()
+                try:
+                    await asyncio.wait_for(self._expiry_event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
             
-            await self.bot.send_message(
+            cutoff = time.monotonic() + EXPIRY_BATCH_SECONDS
+            due = []
+            while self._expiry_heap and self._expiry_heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self._expiry_heap))
+            
+            # Run the batch in its own task so a slow or rate-limited call can't hold up later expiries
+            batch = asyncio.create_task(asyncio.gather(
+                *(self._delete_and_send_buttons(chat_id, message_ids, delay_seconds, file_code)
+                  for _, _, chat_id, message_ids, delay_seconds, file_code in due),
+                return_exceptions=True
+            ))
+            self._expiry_batches.add(batch)
+            batch.add_done_callback(self._expiry_batches.discard)
+    
+    async def _delete_and_send_buttons(self, chat_id: int, message_ids: list, delay_seconds: int, file_code: str = None):
+        """Delete expired messages and send buttons"""
+        # Deletes and the redownload prompt are independent, so issue them together
+        results = await asyncio.gather(
+            self._delete_messages_quietly(chat_id, message_ids),
+            self.bot.send_message(
                 chat_id=chat_id,
                 text="محتوا پاک شد. می‌توانید دوباره دریافت کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-        except Forbidden:
+                reply_markup=self.get_user_keyboard(file_code)
+            ),
+            return_exceptions=True
+        )
+        logger.info("%s messages deleted from chat %s after %s seconds", len(message_ids), chat_id, delay_seconds)
+        
+        error = results[-1]
+        if isinstance(error, Forbidden):
             # User blocked the bot - auto-detected by Telegram API
-            logger.info(f"Cannot send redownload button to {chat_id} - user blocked bot")
-        except Exception as e:
-            logger.error(f"Error in deletion process: {e}")
+            logger.info("Cannot send redownload button to %s - user blocked bot", chat_id)
+        elif isinstance(error, Exception):
+            logger.error("Error in deletion process: %s", error)
     
-    def check_spam(self, user_id: int) -> tuple[bool, int]:
-        """Check if user is spamming"""
-        now = datetime.now(timezone.utc)
+    async def _alert(self, query, user_id: int, text: str):
+        """Answer a callback query with an alert, or silently if the user just saw the same one"""
+        now = time.monotonic()
+        key = (user_id, text)
+        if now - self._last_alerts.get(key, -SPAM_ALERT_REPEAT_SECONDS) < SPAM_ALERT_REPEAT_SECONDS:
+            await query.answer()
+            return
         
-        if user_id in self.spam_control:
-            spam_info = self.spam_control[user_id]
-            last_request = datetime.fromisoformat(spam_info['last_request'])
-            time_diff = (now - last_request).total_seconds()
-            
-            # If less than 2 seconds between requests, count as spam
-            if time_diff < 2:
-                request_count = spam_info.get('request_count', 0) + 1
-                
-                self.spam_control[user_id] = {
-                    'request_count': request_count,
-                    'last_request': now.isoformat(),
-                    'blocked_until': (now + timedelta(seconds=10)).isoformat() if request_count >= 5 else None
-                }
-                
-                # Block for 10 seconds if 5 rapid requests
-                if request_count >= 5:
-                    return True, 10
-                
-                return True, int(2 - time_diff)
-            else:
-                # Reset counter if more than 2 seconds passed
-                self.spam_control[user_id] = {
-                    'request_count': 1,
-                    'last_request': now.isoformat()
-                }
+        if len(self._last_alerts) >= SPAM_TRACKED_USERS_MAX:
+            cutoff = now - SPAM_ALERT_REPEAT_SECONDS
+            self._last_alerts = {k: shown for k, shown in self._last_alerts.items() if shown > cutoff}
+        self._last_alerts[key] = now
+        await query.answer(text, show_alert=True)
+    
+    async def _refuse_for_spam(self, query, user_id: int) -> bool:
+        """Answer and return True if a file-button press must be refused for spam"""
+        if self.is_admin(user_id):
+            return False
+        
+        is_blocked, remaining = self.is_temp_blocked(user_id)
+        if is_blocked:
+            await self._alert(query, user_id, f"⛔ مسدود شده‌اید. {remaining} ثانیه صبر کنید.")
+            return True
+        
+        is_spam, wait_time = await self.check_spam(user_id)
+        if is_spam:
+            await self._alert(query, user_id, f"⚠️ لطفاً {wait_time} ثانیه صبر کنید.")
+            return True
+        return False
+    
+    async def check_spam(self, user_id: int) -> tuple[bool, int]:
+        """Check if user is spamming (blocked on the SPAM_MAX_REQUESTS-th request within SPAM_WINDOW_SECONDS)"""
+        spam_info = self.spam_control.get(user_id)
+        if spam_info is None:
+            spam_info = self.spam_control[user_id] = SpamInfo()
+            if len(self.spam_control) > SPAM_TRACKED_USERS_MAX:
+                self._forget_spam_entry()
         else:
-            self.spam_control[user_id] = {
-                'request_count': 1,
-                'last_request': now.isoformat()
-            }
+            self.spam_control.move_to_end(user_id)
+        
+        if not spam_info.limiter.has_capacity():
+            spam_info.blocked_until = time.monotonic() + SPAM_BLOCK_SECONDS
+            return True, SPAM_BLOCK_SECONDS
         
+        # Has capacity, so this returns without waiting
+        await spam_info.limiter.acquire()
         return False, 0
     
+    def _forget_spam_entry(self):
+        """Drop the least recently seen user that is not serving a block"""
+        now = time.monotonic()
+        for user_id, spam_info in self.spam_control.items():
+            if spam_info.blocked_until <= now:
+                # Safe: we stop iterating right after the delete
+                del self.spam_control[user_id]
+                return
+    
     def is_temp_blocked(self, user_id: int) -> tuple[bool, int]:
         """Check if user is temporarily blocked"""
-        if user_id in self.spam_control and self.spam_control[user_id].get('blocked_until'):
-            blocked_until = datetime.fromisoformat(self.spam_control[user_id]['blocked_until'])
-            now = datetime.now(timezone.utc)
+        spam_info = self.spam_control.get(user_id)
+        if spam_info and spam_info.blocked_until:
+            remaining = spam_info.blocked_until - time.monotonic()
             
-            if now < blocked_until:
-                remaining = int((blocked_until - now).total_seconds())
-                return True, remaining
+            if remaining > 0:
+                return True, int(remaining)
             else:
-                self.spam_control[user_id].pop('blocked_until', None)
-                self.spam_control[user_id]['request_count'] = 0
+                spam_info.blocked_until = 0.0
         
         return False, 0
     
@@ -420,12 +1002,12 @@ class TelegramBot:
                 # User blocked the bot
                 if new_status == 'kicked' and old_status in ['member']:
                     await self.mark_user_blocked_bot(user_id)
-                    logger.info(f"✅ User {user_id} BLOCKED the bot (auto-detected)")
+                    logger.info("✅ User %s BLOCKED the bot (auto-detected)", user_id)
                 
                 # User unblocked the bot
                 elif new_status == 'member' and old_status in ['kicked']:
                     await self.mark_user_unblocked_bot(user_id)
-                    logger.info(f"✅ User {user_id} UNBLOCKED the bot (auto-detected)")
+                    logger.info("✅ User %s UNBLOCKED the bot (auto-detected)", user_id)
                 
                 return
             
@@ -439,10 +1021,10 @@ class TelegramBot:
                 # Get invite link if available
                 try:
                     invite_link = await self.bot.export_chat_invite_link(chat_id=chat_id)
-                    logger.info(f"Exported invite link for {chat_title}: {invite_link}")
+                    logger.info("Exported invite link for %s: %s", chat_title, invite_link)
                 except Exception as e:
                     invite_link = None
-                    logger.warning(f"Cannot export invite link: {e}")
+                    logger.warning("Cannot export invite link: %s", e)
                 
                 # Store detected channel
                 self.detected_channels[chat_id] = {
@@ -455,7 +1037,7 @@ class TelegramBot:
                     'detected_at': datetime.now(timezone.utc).isoformat()
                 }
                 
-                logger.info(f"Bot became admin in {chat_title} (ID: {chat_id})")
+                logger.info("Bot became admin in %s (ID: %s)", chat_title, chat_id)
                 
                 # Notify main admin
                 try:
@@ -488,16 +1070,16 @@ class TelegramBot:
                 except Forbidden:
                     await self.mark_user_blocked_bot(MAIN_ADMIN_ID)
                 except Exception as e:
-                    logger.error(f"Error notifying admin about new channel: {e}")
+                    logger.error("Error notifying admin about new channel: %s", e)
                     
         except Exception as e:
-            logger.error(f"Error in handle_bot_chat_member: {e}")
+            logger.error("Error in handle_bot_chat_member: %s", e)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command - ONLY IN PRIVATE CHAT"""
         # CRITICAL FIX: Only respond in private chat
         if update.effective_chat.type != ChatType.PRIVATE:
-            logger.info(f"Ignoring /start in non-private chat: {update.effective_chat.type}")
+            logger.info("Ignoring /start in non-private chat: %s", update.effective_chat.type)
             return
         
         user = update.effective_user
@@ -506,25 +1088,24 @@ class TelegramBot:
         await self.mark_user_unblocked_bot(user.id)
 
         # Check if user is blocked
-        if user.id in self.users and self.users[user.id].get('is_blocked', False):
-            keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
+        user_info = self.users.get(user.id)
+        if user_info is not None and user_info.is_blocked:
             await update.message.reply_text(
                 "⛔ شما توسط ادمین بلاک شده‌اید.\n\n"
                 "برای رفع مسدودیت با ادمین تماس بگیرید.\n\n"
                 "می‌توانید از دکمه زیر استفاده کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=self.get_user_keyboard()
             )
             return
         
         # Update or create user
-        self.users[user.id] = {
-            'user_id': user.id,
-            'username': user.username or 'unknown',
-            'first_name': user.first_name or 'unknown',
-            'is_blocked': False,
-            'is_bot_blocked': False,
-            'last_seen': datetime.now(timezone.utc).isoformat()
-        }
+        if user_info is None:
+            user_info = self.users[user.id] = UserInfo(user_id=user.id)
+        user_info.username = user.username or 'unknown'
+        user_info.first_name = user.first_name or 'unknown'
+        user_info.is_bot_blocked = False
+        user_info.last_seen = time.time()
+        self.save_user(user.id)
         
         is_admin = self.is_admin(user.id)
         
@@ -536,43 +1117,22 @@ class TelegramBot:
         
         # Regular start message
         if is_admin:
-            admin_text = (
-                f"👋 سلام {user.first_name}!\n\n"
-                f"✨ شما ادمین هستید. برای آپلود فایل، عکس یا ویدیو را ارسال کنید.\n\n"
-                f"📝 می‌توانید چند فایل پشت سر هم ارسال کنید و یک لینک واحد دریافت کنید.\n\n"
-                f"💬 برای پاسخ به پیام کاربران، روی پیام آن‌ها Reply کنید.\n\n"
-                f"⚠️ توجه: بات بدون دیتابیس است. با restart، لینک‌ها و تنظیمات پاک می‌شوند!\n\n"
-                f"از دکمه‌های زیر برای مدیریت بات استفاده کنید:"
-            )
-            
-            # Add admin management button only for main admin
-            if user.id == MAIN_ADMIN_ID:
-                keyboard = [
-                    [KeyboardButton("👥 کاربران"), KeyboardButton("📁 فایل‌ها")],
-                    [KeyboardButton("📨 ارسال PM"), KeyboardButton("🔒 جوین اجباری")],
-                    [KeyboardButton("📢 ارسال پست به کانال")],
-                    [KeyboardButton("👤 مدیریت ادمین‌ها")]
-                ]
-                admin_keyboard = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            else:
-                admin_keyboard = self.get_admin_keyboard()
+            admin_text = ADMIN_WELCOME_TEMPLATE.format_map({'name': user.first_name})
             
-            await update.message.reply_text(admin_text, reply_markup=admin_keyboard)
+            # Admin management button is only shown to the main admin
+            await update.message.reply_text(admin_text, reply_markup=self.get_admin_keyboard(user.id))
         else:
             # User start - show inline button for contact admin
-            keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
             await update.message.reply_text(
-                f"👋 سلام {user.first_name}\n\n"
-                f"برای دریافت فایل‌ها، لینک را از ادمین دریافت کنید.\n\n"
-                f"یا می‌توانید از دکمه زیر برای ارتباط با مدیر استفاده کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                USER_WELCOME_TEMPLATE.format_map({'name': user.first_name}),
+                reply_markup=self.get_user_keyboard()
             )
     
     async def handle_file_access(self, update: Update, context: ContextTypes.DEFAULT_TYPE, file_code: str):
         """Handle file access request - ONLY IN PRIVATE CHAT"""
         # CRITICAL FIX: Only respond in private chat
         if update.effective_chat.type != ChatType.PRIVATE:
-            logger.info(f"Ignoring file access in non-private chat")
+            logger.info("Ignoring file access in non-private chat")
             return
         
         user = update.effective_user
@@ -589,46 +1149,28 @@ class TelegramBot:
                 return
             
             # Check spam
-            is_spam, wait_time = self.check_spam(user.id)
+            is_spam, wait_time = await self.check_spam(user.id)
             if is_spam:
-                if wait_time >= 10:
-                    await update.message.reply_text(
-                        f"⛔ شما به دلیل اسپم برای 10 ثانیه مسدود شدید!\n\n"
-                        "لطفاً صبر کنید."
-                    )
-                else:
-                    await update.message.reply_text(
-                        f"⚠️ لطفاً کمی صبر کنید.\n\n"
-                        f"⏱️ {wait_time} ثانیه دیگر تلاش کنید."
-                    )
+                await update.message.reply_text(
+                    f"⛔ شما به دلیل اسپم برای {wait_time} ثانیه مسدود شدید!\n\n"
+                    "لطفاً صبر کنید."
+                )
                 return
         
         # Check if file exists
-        if file_code not in self.files:
+        file_group = self.files.get(file_code)
+        if file_group is None:
             await update.message.reply_text("❌ این لینک وجود ندارد یا منقضی شده است.")
             return
         
-        # Check membership with force recheck
-        is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
+        # Check membership with force recheck (admins and channel-less setups skip the call)
+        if not self.mandatory_channels or self.is_admin(user.id):
+            is_member, not_joined_channels = True, []
+        else:
+            is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
         
         if not is_member:
-            keyboard = []
-            for channel in not_joined_channels:
-                channel_key = str(channel.get('chat_id') or channel.get('identifier'))
-                channel_url = self.get_channel_url(channel)
-                
-                # Always use URL button (no callback) - direct link
-                keyboard.append([InlineKeyboardButton(
-                    channel['button_text'],
-                    url=channel_url
-                )])
-            
-            keyboard.append([InlineKeyboardButton(
-                "✅ عضو شدم",
-                callback_data=f"check_{file_code}"
-            )])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self._build_join_markup(not_joined_channels, file_code)
             await update.message.reply_text(
                 "⚠️ برای دریافت فایل، ابتدا باید در کانال‌ها/گروه‌های زیر عضو شوید:\n\n"
                 "👇 روی دکمه‌های زیر کلیک کنید و عضو شوید، سپس «عضو شدم ✅» را بزنید:",
@@ -637,70 +1179,54 @@ class TelegramBot:
             return
         
         # Send files
-        await self.send_files_to_user(user.id, self.files[file_code], file_code)
+        await self.send_files_to_user(user.id, file_group, file_code)
     
-    async def send_files_to_user(self, user_id: int, file_group: dict, file_code: str):
+    async def send_files_to_user(self, user_id: int, file_group: FileInfo, file_code: str):
         """Send multiple files to user"""
+        delete_seconds = file_group.delete_seconds
+        sent_message_ids = []
         try:
-            files_list = file_group['files']  # List of files
-            caption_text = file_group.get('caption', '')
-            delete_seconds = file_group.get('delete_seconds', FILE_DELETE_SECONDS)
+            files_list = file_group.files
+            caption_text = file_group.caption
             
-            sent_message_ids = []
+            expiry_note = f"⏱️ این محتوا بعد از {delete_seconds} ثانیه پاک می‌شود!"
             
+            media = []
             for idx, file_doc in enumerate(files_list):
-                # Add caption only to first file
-                if idx == 0 and caption_text:
-                    full_caption = f"{caption_text}\n\n⏱️ این محتوا بعد از {delete_seconds} ثانیه پاک می‌شود!"
+                # Telegram shows an album's caption only if exactly one item carries it
+                if idx == 0:
+                    caption = f"{caption_text}\n\n{expiry_note}" if caption_text else expiry_note
                 else:
-                    full_caption = f"⏱️ این محتوا بعد از {delete_seconds} ثانیه پاک می‌شود!"
-                
-                sent_message = None
+                    caption = None
                 
                 if file_doc['file_type'] == 'photo':
-                    sent_message = await self.bot.send_photo(
-                        chat_id=user_id,
-                        photo=file_doc['telegram_file_id'],
-                        caption=full_caption if idx == 0 or not caption_text else None
-                    )
+                    media.append(InputMediaPhoto(file_doc['telegram_file_id'], caption=caption))
                 elif file_doc['file_type'] == 'video':
-                    sent_message = await self.bot.send_video(
-                        chat_id=user_id,
-                        video=file_doc['telegram_file_id'],
-                        caption=full_caption if idx == 0 or not caption_text else None
-                    )
-                
-                if sent_message:
+                    media.append(InputMediaVideo(file_doc['telegram_file_id'], caption=caption))
+            
+            # One sendMediaGroup per album of up to MEDIA_GROUP_MAX files; albums need at least two
+            for start in range(0, len(media), MEDIA_GROUP_MAX):
+                chunk = media[start:start + MEDIA_GROUP_MAX]
+                if len(chunk) > 1:
+                    sent_messages = await self.bot.send_media_group(chat_id=user_id, media=chunk)
+                    sent_message_ids.extend(message.message_id for message in sent_messages)
+                elif isinstance(chunk[0], InputMediaPhoto):
+                    sent_message = await self.bot.send_photo(chat_id=user_id, photo=chunk[0].media, caption=chunk[0].caption)
+                    sent_message_ids.append(sent_message.message_id)
+                else:
+                    sent_message = await self.bot.send_video(chat_id=user_id, video=chunk[0].media, caption=chunk[0].caption)
                     sent_message_ids.append(sent_message.message_id)
             
-            # Schedule deletion for all messages
-            if sent_message_ids:
-                asyncio.create_task(
-                    self.schedule_message_deletion_and_send_buttons(
-                        chat_id=user_id,
-                        message_ids=sent_message_ids,
-                        delay_seconds=delete_seconds,
-                        file_code=file_code
-                    )
-                )
-            
-            # Track download with more details
-            download_record = {
-                'file_code': file_code,
-                'user_id': user_id,
-                'downloaded_at': datetime.now(timezone.utc).isoformat(),
-                'file_count': len(files_list),
-                'caption': caption_text[:50] if caption_text else 'بدون متن'  # First 50 chars
-            }
-            self.downloads.append(download_record)
+            # Track download
+            self.downloads.append((file_code, user_id, time.time()))
             
-            logger.info(f"Files {file_code} sent to user {user_id}")
+            logger.info("Files %s sent to user %s", file_code, user_id)
         except Forbidden:
             # User blocked the bot
             await self.mark_user_blocked_bot(user_id)
-            logger.warning(f"User {user_id} has blocked the bot")
+            logger.warning("User %s has blocked the bot", user_id)
         except Exception as e:
-            logger.error(f"Error sending files: {e}")
+            logger.error("Error sending files: %s", e)
             try:
                 await self.bot.send_message(
                     chat_id=user_id,
@@ -708,12 +1234,21 @@ class TelegramBot:
                 )
             except Forbidden:
                 await self.mark_user_blocked_bot(user_id)
+        finally:
+            # Also runs when a later album fails, so albums already sent still expire
+            if sent_message_ids:
+                self.schedule_message_deletion_and_send_buttons(
+                    chat_id=user_id,
+                    message_ids=sent_message_ids,
+                    delay_seconds=delete_seconds,
+                    file_code=file_code
+                )
     
     async def handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo/video uploads - ONLY IN PRIVATE CHAT"""
         # CRITICAL FIX: Only respond in private chat
         if update.effective_chat.type != ChatType.PRIVATE:
-            logger.info(f"Ignoring media in non-private chat")
+            logger.info("Ignoring media in non-private chat")
             return
         
         user = update.effective_user
@@ -728,10 +1263,9 @@ class TelegramBot:
             if context.user_data.get('awaiting') == 'user_content_to_admin':
                 await self.handle_user_media_to_admin(update, context)
             else:
-                keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
                 await update.message.reply_text(
                     "❌ لطفاً ابتدا از دکمه «ارتباط با مدیر» استفاده کنید.",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=self.get_user_keyboard()
                 )
     
     async def handle_post_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -747,12 +1281,11 @@ class TelegramBot:
         context.user_data['post_photo_id'] = update.message.photo[-1].file_id
         context.user_data['awaiting'] = 'post_caption'
         
-        keyboard = [[InlineKeyboardButton("🚫 بدون متن", callback_data="no_post_caption")]]
         await update.message.reply_text(
             "✅ عکس دریافت شد!\n\n"
             "📝 حالا متن پست (Caption) را ارسال کنید:\n\n"
             "یا روی دکمه «بدون متن» کلیک کنید.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=NO_POST_CAPTION_MARKUP
         )
     
     async def handle_admin_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -770,25 +1303,17 @@ class TelegramBot:
             await update.message.reply_text("❌ فقط عکس و ویدیو پشتیبانی می‌شود.")
             return
         
-        # Initialize temp_files list if not exists
-        if 'temp_files' not in context.user_data:
-            context.user_data['temp_files'] = []
-        
-        # Add file to list
-        context.user_data['temp_files'].append({
+        # Add file to list (created on the first upload)
+        temp_files = context.user_data.setdefault('temp_files', [])
+        temp_files.append({
             'file_type': file_type,
             'telegram_file_id': telegram_file_id
         })
         
-        file_count = len(context.user_data['temp_files'])
+        file_count = len(temp_files)
         
         # Ask if user wants to add more files
-        keyboard = [
-            [InlineKeyboardButton("✅ بله، فایل دیگری هم دارم", callback_data="add_more_files")],
-            [InlineKeyboardButton("❌ نه، تمام شد", callback_data="finish_files")],
-            [InlineKeyboardButton("🗑 لغو و پاک کردن همه", callback_data="cancel_upload")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = MORE_FILES_MARKUP
         
         await update.message.reply_text(
             f"✅ فایل {file_count} دریافت شد!\n\n"
@@ -812,14 +1337,10 @@ class TelegramBot:
             await update.message.reply_text("❌ لطفاً یک عکس یا ویدیو ارسال کنید.")
             return
         
-        context.user_data['temp_user_file'] = {
-            'file_type': file_type,
-            'telegram_file_id': telegram_file_id
-        }
+        context.user_data['temp_user_file'] = PendingUserFile(file_type, telegram_file_id)
         context.user_data['awaiting'] = 'user_caption_to_admin'
         
-        keyboard = [[InlineKeyboardButton("🚫 بدون توضیحات", callback_data="no_user_caption")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = NO_USER_CAPTION_MARKUP
         
         await update.message.reply_text(
             "✅ فایل دریافت شد!\n\n"
@@ -837,25 +1358,28 @@ class TelegramBot:
             f"👤 یوزرنیم: @{user_info.get('username', 'ندارد')}\n\n"
         )
         
-        for admin_id in self.admins.keys():
+        # The payload is identical for every admin, so build it once
+        if message_type == 'text':
+            full_text = f"{header_text}💬 پیام:\n{content}\n\n💡 برای پاسخ، روی این پیام Reply کنید."
+        else:
+            caption = f"{header_text}💬 توضیحات:\n{content if content else 'بدون توضیحات'}\n\n💡 برای پاسخ، روی این پیام Reply کنید."
+        
+        async def send_one(admin_id: int):
             try:
                 sent_msg = None
                 
                 if message_type == 'text':
-                    full_text = f"{header_text}💬 پیام:\n{content}\n\n💡 برای پاسخ، روی این پیام Reply کنید."
                     sent_msg = await self.bot.send_message(
                         chat_id=admin_id,
                         text=full_text
                     )
                 elif message_type == 'photo':
-                    caption = f"{header_text}💬 توضیحات:\n{content if content else 'بدون توضیحات'}\n\n💡 برای پاسخ، روی این پیام Reply کنید."
                     sent_msg = await self.bot.send_photo(
                         chat_id=admin_id,
                         photo=telegram_file_id,
                         caption=caption
                     )
                 elif message_type == 'video':
-                    caption = f"{header_text}💬 توضیحات:\n{content if content else 'بدون توضیحات'}\n\n💡 برای پاسخ، روی این پیام Reply کنید."
                     sent_msg = await self.bot.send_video(
                         chat_id=admin_id,
                         video=telegram_file_id,
@@ -864,12 +1388,16 @@ class TelegramBot:
                 
                 if sent_msg:
                     self.user_message_map[sent_msg.message_id] = user_info['user_id']
+                    if len(self.user_message_map) > MAX_MESSAGE_MAP:
+                        self.user_message_map.popitem(last=False)
                     
-                logger.info(f"User message forwarded to admin {admin_id}")
+                logger.info("User message forwarded to admin %s", admin_id)
             except Forbidden:
                 await self.mark_user_blocked_bot(admin_id)
             except Exception as e:
-                logger.error(f"Error forwarding to admin {admin_id}: {e}")
+                logger.error("Error forwarding to admin %s: %s", admin_id, e)
+        
+        await asyncio.gather(*(send_one(admin_id) for admin_id in list(self.admins)), return_exceptions=True)
     
     async def handle_admin_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle admin reply to user message - ONLY IN PRIVATE CHAT"""
@@ -898,40 +1426,42 @@ class TelegramBot:
                 text=reply_text
             )
             await update.message.reply_text("✅ پیام شما به کاربر ارسال شد.")
-            logger.info(f"Admin {user.id} replied to user {target_user_id}")
+            logger.info("Admin %s replied to user %s", user.id, target_user_id)
             return True
         except Forbidden:
             await self.mark_user_blocked_bot(target_user_id)
             await update.message.reply_text("❌ کاربر بات را بلاک کرده است.")
             return True
         except Exception as e:
-            logger.error(f"Error sending admin reply: {e}")
+            logger.error("Error sending admin reply: %s", e)
             await update.message.reply_text("❌ خطا در ارسال پیام به کاربر.")
             return True
     
     async def broadcast_message(self, message_text: str, admin_id: int):
         """Send message to all active users"""
-        success_count = 0
-        fail_count = 0
-        blocked_count = 0
+        recipients = list(self._active_user_ids)
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
         
-        for user_id, user_info in self.users.items():
-            if user_info.get('is_blocked', False) or user_info.get('is_bot_blocked', False):
-                continue
-                
-            try:
-                await self.bot.send_message(
-                    chat_id=user_id,
-                    text=message_text
-                )
-                success_count += 1
-                await asyncio.sleep(0.05)
-            except Forbidden:
-                await self.mark_user_blocked_bot(user_id)
-                blocked_count += 1
-            except Exception as e:
-                logger.error(f"Error broadcasting to user {user_id}: {e}")
-                fail_count += 1
+        async def send_one(user_id: int) -> str:
+            async with semaphore:
+                try:
+                    await self.bot.send_message(
+                        chat_id=user_id,
+                        text=message_text
+                    )
+                    return 'success'
+                except Forbidden:
+                    await self.mark_user_blocked_bot(user_id)
+                    return 'blocked'
+                except Exception as e:
+                    logger.debug("Error broadcasting to user %s: %s", user_id, e)
+                    return 'failed'
+        
+        results = await asyncio.gather(*(send_one(user_id) for user_id in recipients))
+        success_count = results.count('success')
+        fail_count = results.count('failed')
+        blocked_count = results.count('blocked')
+        logger.info("Broadcast finished: %s sent, %s failed, %s blocked", success_count, fail_count, blocked_count)
         
         try:
             await self.bot.send_message(
@@ -941,561 +1471,954 @@ class TelegramBot:
         except Forbidden:
             await self.mark_user_blocked_bot(admin_id)
     
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle button callbacks"""
-        query = update.callback_query
+    async def _broadcast_worker(self):
+        """Process queued broadcasts in the background"""
+        while True:
+            admin_id, message_text = await self.broadcast_queue.get()
+            try:
+                await self.broadcast_message(message_text, admin_id)
+            except Exception as e:
+                logger.error("Error in broadcast worker: %s", e)
+            finally:
+                self.broadcast_queue.task_done()
+    
+    async def _cb_contact_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """User wants to send a message to the admins"""
+        await query.answer()
+        context.user_data['awaiting'] = 'user_content_to_admin'
+        await query.edit_message_text(
+            "📞 ارتباط با مدیر\n\n"
+            "لطفاً پیام، عکس یا ویدیوی خود را ارسال کنید:",
+            reply_markup=CANCEL_MARKUP
+        )
+    
+    async def _cb_no_post_caption(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Channel post without caption - ask for the URL"""
         await query.answer()
+        context.user_data['post_caption'] = None
+        context.user_data['awaiting'] = 'post_url'
         
+        await query.edit_message_text(
+            "🔗 حالا لینک (URL) را وارد کنید:\n\n"
+            "مثال: https://t.me/yourchannel"
+        )
+    
+    async def _cb_add_new_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Main admin starts adding a new admin"""
         user = update.effective_user
-        data = query.data
-        
-        # Handle contact admin for users
-        if data == "contact_admin":
-            context.user_data['awaiting'] = 'user_content_to_admin'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
-            await query.edit_message_text(
-                "📞 ارتباط با مدیر\n\n"
-                "لطفاً پیام، عکس یا ویدیوی خود را ارسال کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        if user.id != MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ فقط ادمین اصلی دسترسی دارد.")
             return
         
-        # Handle viewing user download history
-        if data.startswith("viewhist_"):
-            if not self.is_admin(user.id):
-                await query.answer("❌ فقط ادمین‌ها دسترسی دارند.", show_alert=True)
-                return
-            
-            target_user_id = int(data.replace("viewhist_", ""))
-            downloads = self.get_user_downloads(target_user_id)
-            
-            if not downloads:
-                await query.answer("این کاربر هیچ فایلی دانلود نکرده است.", show_alert=True)
-                return
-            
-            user_info = self.users.get(target_user_id, {})
-            message = f"📥 تاریخچه دانلود کاربر:\n\n"
-            message += f"👤 {user_info.get('first_name', 'Unknown')} (@{user_info.get('username', 'ندارد')})\n"
-            message += f"🆔 {target_user_id}\n\n"
-            message += f"📊 تعداد کل دانلودها: {len(downloads)}\n\n"
-            message += "━━━━━━━━━━━━━━━━\n\n"
-            
-            for idx, dl in enumerate(downloads[-10:], 1):  # Last 10 downloads
-                download_time = datetime.fromisoformat(dl['downloaded_at']).strftime('%Y-%m-%d %H:%M')
-                message += f"{idx}. 📁 کد: {dl['file_code']}\n"
-                message += f"   📝 {dl.get('caption', 'بدون متن')}\n"
-                message += f"   📦 {dl.get('file_count', 1)} فایل\n"
-                message += f"   🕐 {download_time}\n\n"
-            
-            if len(downloads) > 10:
-                message += f"... و {len(downloads) - 10} دانلود دیگر"
-            
-            await query.edit_message_text(message)
+        await query.answer()
+        context.user_data['awaiting'] = 'new_admin_id'
+        await query.edit_message_text(
+            "👤 لطفاً آیدی عددی کاربر را برای افزودن به عنوان ادمین ارسال کنید:",
+            reply_markup=CANCEL_MARKUP
+        )
+    
+    async def _cb_add_more_files(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Admin will upload another file to the same link"""
+        await query.answer()
+        await query.edit_message_text(
+            f"📤 در انتظار فایل بعدی...\n\n"
+            f"📦 تعداد فایل‌های دریافت شده: {len(context.user_data.get('temp_files', []))}\n\n"
+            "لطفاً فایل بعدی را ارسال کنید."
+        )
+    
+    async def _cb_finish_files(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Admin finished uploading - ask for the caption"""
+        await query.answer()
+        if not context.user_data.get('temp_files'):
+            await query.edit_message_text("❌ خطا: فایلی یافت نشد.")
+            context.user_data.clear()
             return
         
-        # Handle post to channel flow
-        if data == "no_post_caption":
-            if not self.is_admin(user.id):
-                return
-            
-            context.user_data['post_caption'] = None
-            context.user_data['awaiting'] = 'post_url'
-            
-            await query.edit_message_text(
-                "🔗 حالا لینک (URL) را وارد کنید:\n\n"
-                "مثال: https://t.me/yourchannel"
-            )
+        context.user_data['awaiting'] = 'caption_for_files'
+        reply_markup = NO_CAPTION_FILES_MARKUP
+        
+        await query.edit_message_text(
+            f"✅ {len(context.user_data['temp_files'])} فایل دریافت شد!\n\n"
+            "📝 لطفاً یک متن واحد برای همه فایل‌ها ارسال کنید:\n\n"
+            "یا روی دکمه «بدون متن» کلیک کنید.",
+            reply_markup=reply_markup
+        )
+    
+    @clears_state
+    async def _cb_cancel_upload(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Admin cancelled the upload"""
+        await query.answer()
+        await query.edit_message_text(
+            "🗑 آپلود لغو شد و همه فایل‌ها پاک شدند."
+        )
+    
+    async def _cb_no_caption_files(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Upload without caption - ask for the deletion delay"""
+        await query.answer()
+        if not context.user_data.get('temp_files'):
+            await query.edit_message_text("❌ خطا: فایلی یافت نشد.")
+            context.user_data.clear()
             return
         
-        elif data.startswith("select_channel_"):
-            if not self.is_admin(user.id):
-                return
-            
-            chat_id = int(data.replace("select_channel_", ""))
-            
-            if chat_id not in self.detected_channels:
-                await query.answer("❌ کانال پیدا نشد.", show_alert=True)
-                return
-            
-            # Get post data
-            photo_id = context.user_data.get('post_photo_id')
-            caption = context.user_data.get('post_caption', '')
-            button_text = context.user_data.get('post_button_text')
-            url = context.user_data.get('post_url')
-            
-            if not photo_id or not button_text or not url:
-                await query.answer("❌ خطا: اطلاعات ناقص است.", show_alert=True)
-                context.user_data.clear()
+        context.user_data['caption'] = None
+        context.user_data['awaiting'] = 'delete_time'
+        
+        await query.edit_message_text(
+            "⏱️ چه مدت بعد محتوا پاک شود؟\n\n"
+            "لطفاً یک عدد بین 5 تا 30 (ثانیه) وارد کنید:\n\n"
+            "مثال: 10"
+        )
+    
+    @clears_state
+    async def _cb_cancel_user_send(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Cancel the current flow and show the start message"""
+        await query.answer()
+        user = update.effective_user
+        await query.edit_message_text(
+            USER_WELCOME_TEMPLATE.format_map({'name': user.first_name}),
+            reply_markup=self.get_user_keyboard()
+        )
+    
+    @clears_state
+    async def _cb_no_user_caption(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+        """Forward the user's file to admins without a caption"""
+        await query.answer()
+        user = update.effective_user
+        temp_file = context.user_data.get('temp_user_file')
+        if temp_file is None:
+            await query.edit_message_text("❌ خطا: فایلی یافت نشد. لطفاً دوباره تلاش کنید.")
+            return
+        
+        user_info = {
+            'user_id': user.id,
+            'username': user.username,
+            'first_name': user.first_name
+        }
+        
+        await self.forward_to_admins(
+            message_type=temp_file.file_type,
+            content=None,
+            user_info=user_info,
+            telegram_file_id=temp_file.telegram_file_id
+        )
+        
+        await query.edit_message_text(
+            "✅ فایل شما با موفقیت برای ادمین ارسال شد!\n\n"
+            "⏳ لطفاً منتظر پاسخ ادمین باشید."
+        )
+    
+    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle button callbacks; every handler answers the query exactly once"""
+        query = update.callback_query
+        user = update.effective_user
+        data = query.data
+        
+        if data in self._ADMIN_ONLY_ACTIONS and not self.is_admin(user.id):
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
+            return
+        
+        handler = self._cb_handlers.get(data)
+        if handler:
+            await handler(update, context, query)
+            return
+        
+        for prefix, handler in self._cb_prefix_handlers:
+            if data.startswith(prefix):
+                await handler(update, context, query, data[len(prefix):])
                 return
-            
-            # Send post to channel
-            try:
-                keyboard = [[InlineKeyboardButton(button_text, url=url)]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo_id,
-                    caption=caption if caption else None,
-                    reply_markup=reply_markup
-                )
-                
-                channel_info = self.detected_channels[chat_id]
-                await query.edit_message_text(
-                    f"✅ پست با موفقیت به کانال ارسال شد!\n\n"
-                    f"📢 کانال: {channel_info['title']}\n"
-                    f"🆔 Chat ID: {chat_id}"
-                )
-                
-                logger.info(f"Post sent to channel {chat_id} by admin {user.id}")
-            except Exception as e:
-                logger.error(f"Error sending post to channel: {e}")
-                await query.edit_message_text(f"❌ خطا در ارسال پست به کانال:\n\n{str(e)}")
-            
+        
+        await query.answer()
+    
+    async def _cb_viewhist(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Show the last downloads of a user"""
+        user = update.effective_user
+        if not self.is_admin(user.id):
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
+            return
+        
+        target_user_id = int(payload)
+        downloads = self.get_user_downloads(target_user_id)
+        
+        if not downloads:
+            await self._alert(query, user.id, "این کاربر هیچ فایلی دانلود نکرده است.")
+            return
+        
+        user_info = self.users.get(target_user_id) or UserInfo(user_id=target_user_id, username='ندارد', first_name='Unknown')
+        message = f"📥 تاریخچه دانلود کاربر:\n\n"
+        message += f"👤 {user_info.first_name} (@{user_info.username})\n"
+        message += f"🆔 {target_user_id}\n\n"
+        message += f"📊 تعداد کل دانلودها: {len(downloads)}\n\n"
+        message += "━━━━━━━━━━━━━━━━\n\n"
+        
+        for idx, dl in enumerate(map(self._download_to_dict, downloads[-10:]), 1):  # Last 10 downloads
+            download_time = dl['downloaded_at'].strftime('%Y-%m-%d %H:%M')
+            message += f"{idx}. 📁 کد: {dl['file_code']}\n"
+            message += f"   📝 {dl['caption']}\n"
+            message += f"   📦 {dl['file_count']} فایل\n"
+            message += f"   🕐 {download_time}\n\n"
+        
+        if len(downloads) > 10:
+            message += f"... و {len(downloads) - 10} دانلود دیگر"
+        
+        await query.answer()
+        await query.edit_message_text(message)
+    
+    async def _cb_select_channel(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Send the prepared post to the chosen channel"""
+        user = update.effective_user
+        if not self.is_admin(user.id):
+            await query.answer()
+            return
+        
+        chat_id = int(payload)
+        
+        if chat_id not in self.detected_channels:
+            await self._alert(query, user.id, "❌ کانال پیدا نشد.")
+            return
+        
+        # Get post data
+        photo_id = context.user_data.get('post_photo_id')
+        caption = context.user_data.get('post_caption', '')
+        button_text = context.user_data.get('post_button_text')
+        url = context.user_data.get('post_url')
+        
+        if not photo_id or not button_text or not url:
+            await self._alert(query, user.id, "❌ خطا: اطلاعات ناقص است.")
             context.user_data.clear()
             return
         
-        # Handle auto-detected channels
-        if data.startswith("autoadd_"):
-            if user.id != MAIN_ADMIN_ID:
-                await query.answer("❌ فقط ادمین اصلی دسترسی دارد.", show_alert=True)
-                return
-            
-            chat_id = int(data.replace("autoadd_", ""))
-            
-            if chat_id not in self.detected_channels:
-                await query.answer("❌ کانال پیدا نشد.", show_alert=True)
-                return
+        await query.answer()
+        
+        # Send post to channel
+        try:
+            keyboard = [[InlineKeyboardButton(button_text, url=url)]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # Set up to add channel - ask for button text
-            context.user_data['temp_channel_from_auto'] = self.detected_channels[chat_id]
-            context.user_data['awaiting'] = 'auto_channel_button_text'
+            await self.bot.send_photo(
+                chat_id=chat_id,
+                photo=photo_id,
+                caption=caption if caption else None,
+                reply_markup=reply_markup
+            )
             
             channel_info = self.detected_channels[chat_id]
             await query.edit_message_text(
-                f"✅ کانال انتخاب شد!\n\n"
-                f"📢 نام: {channel_info['title']}\n"
-                f"🆔 Chat ID: {chat_id}\n\n"
-                f"📝 حالا متن دکمه را وارد کنید:\n\n"
-                f"مثال: عضویت در کانال اصلی"
+                f"✅ پست با موفقیت به کانال ارسال شد!\n\n"
+                f"📢 کانال: {channel_info['title']}\n"
+                f"🆔 Chat ID: {chat_id}"
             )
+            
+            logger.info("Post sent to channel %s by admin %s", chat_id, user.id)
+        except Exception as e:
+            logger.error("Error sending post to channel: %s", e)
+            await query.edit_message_text(f"❌ خطا در ارسال پست به کانال:\n\n{str(e)}")
+        
+        context.user_data.clear()
+    
+    async def _cb_autoadd(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Add an auto-detected channel - ask for its button text"""
+        user = update.effective_user
+        if user.id != MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ فقط ادمین اصلی دسترسی دارد.")
             return
         
-        elif data.startswith("autostore_"):
-            if user.id != MAIN_ADMIN_ID:
-                await query.answer("❌ فقط ادمین اصلی دسترسی دارد.", show_alert=True)
-                return
-            
-            chat_id = int(data.replace("autostore_", ""))
-            await query.answer("✅ کانال ذخیره شد!", show_alert=True)
-            await query.edit_message_text(
-                f"{query.message.text}\n\n"
-                f"✅ کانال ذخیره شد. می‌توانید بعداً از منوی جوین اجباری آن را اضافه کنید."
-            )
+        chat_id = int(payload)
+        
+        if chat_id not in self.detected_channels:
+            await self._alert(query, user.id, "❌ کانال پیدا نشد.")
             return
         
-        elif data.startswith("autoignore_"):
-            if user.id != MAIN_ADMIN_ID:
-                await query.answer("❌ فقط ادمین اصلی دسترسی دارد.", show_alert=True)
-                return
-            
-            chat_id = int(data.replace("autoignore_", ""))
-            
-            if chat_id in self.detected_channels:
-                del self.detected_channels[chat_id]
-            
-            await query.answer("✅ نادیده گرفته شد.", show_alert=True)
-            await query.edit_message_text(f"{query.message.text}\n\n❌ نادیده گرفته شد.")
+        # Set up to add channel - ask for button text
+        await query.answer()
+        context.user_data['temp_channel_from_auto'] = self.detected_channels[chat_id]
+        context.user_data['awaiting'] = 'auto_channel_button_text'
+        
+        channel_info = self.detected_channels[chat_id]
+        await query.edit_message_text(
+            f"✅ کانال انتخاب شد!\n\n"
+            f"📢 نام: {channel_info['title']}\n"
+            f"🆔 Chat ID: {chat_id}\n\n"
+            f"📝 حالا متن دکمه را وارد کنید:\n\n"
+            f"مثال: عضویت در کانال اصلی"
+        )
+    
+    async def _cb_autostore(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Keep an auto-detected channel for later"""
+        user = update.effective_user
+        if user.id != MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ فقط ادمین اصلی دسترسی دارد.")
             return
         
-        # Handle admin management - Only main admin can access
-        if data == "add_new_admin":
-            if user.id != MAIN_ADMIN_ID:
-                await query.answer("❌ فقط ادمین اصلی دسترسی دارد.", show_alert=True)
-                return
-            
-            context.user_data['awaiting'] = 'new_admin_id'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
-            await query.edit_message_text(
-                "👤 لطفاً آیدی عددی کاربر را برای افزودن به عنوان ادمین ارسال کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        chat_id = int(payload)
+        await self._alert(query, user.id, "✅ کانال ذخیره شد!")
+        await query.edit_message_text(
+            f"{query.message.text}\n\n"
+            f"✅ کانال ذخیره شد. می‌توانید بعداً از منوی جوین اجباری آن را اضافه کنید."
+        )
+    
+    async def _cb_autoignore(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Forget an auto-detected channel"""
+        user = update.effective_user
+        if user.id != MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ فقط ادمین اصلی دسترسی دارد.")
             return
         
-        elif data.startswith("removeadmin_"):
-            if user.id != MAIN_ADMIN_ID:
-                await query.answer("❌ فقط ادمین اصلی دسترسی دارد.", show_alert=True)
-                return
+        chat_id = int(payload)
+        
+        if chat_id in self.detected_channels:
+            del self.detected_channels[chat_id]
+        
+        await self._alert(query, user.id, "✅ نادیده گرفته شد.")
+        await query.edit_message_text(f"{query.message.text}\n\n❌ نادیده گرفته شد.")
+    
+    async def _cb_removeadmin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Remove an admin (main admin only)"""
+        user = update.effective_user
+        if user.id != MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ فقط ادمین اصلی دسترسی دارد.")
+            return
+        
+        admin_id_to_remove = int(payload)
+        
+        if admin_id_to_remove == MAIN_ADMIN_ID:
+            await self._alert(query, user.id, "❌ نمی‌توانید ادمین اصلی را حذف کنید.")
+            return
+        
+        if admin_id_to_remove in self.admins:
+            self.remove_admin(admin_id_to_remove)
+            await self._alert(query, user.id, f"✅ ادمین {admin_id_to_remove} حذف شد.")
             
-            admin_id_to_remove = int(data.replace("removeadmin_", ""))
+            # Refresh admin list
+            admin_list = "👥 لیست ادمین‌های فعلی:\n\n"
+            keyboard = []
             
-            if admin_id_to_remove == MAIN_ADMIN_ID:
-                await query.answer("❌ نمی‌توانید ادمین اصلی را حذف کنید.", show_alert=True)
-                return
+            for admin_id in self.admins.keys():
+                if admin_id == MAIN_ADMIN_ID:
+                    admin_list += f"• {admin_id} (ادمین اصلی) ⭐\n"
+                else:
+                    admin_list += f"• {admin_id}\n"
+                    keyboard.append([InlineKeyboardButton(f"🗑 حذف {admin_id}", callback_data=f"removeadmin_{admin_id}")])
             
-            if admin_id_to_remove in self.admins:
-                del self.admins[admin_id_to_remove]
-                await query.answer(f"✅ ادمین {admin_id_to_remove} حذف شد.", show_alert=True)
-                
-                # Refresh admin list
-                admin_list = "👥 لیست ادمین‌های فعلی:\n\n"
-                keyboard = []
-                
-                for admin_id in self.admins.keys():
-                    if admin_id == MAIN_ADMIN_ID:
-                        admin_list += f"• {admin_id} (ادمین اصلی) ⭐\n"
-                    else:
-                        admin_list += f"• {admin_id}\n"
-                        keyboard.append([InlineKeyboardButton(f"🗑 حذف {admin_id}", callback_data=f"removeadmin_{admin_id}")])
-                
-                admin_list += "\n💡 برای افزودن ادمین جدید، از دکمه زیر استفاده کنید:"
-                keyboard.append([InlineKeyboardButton("➕ افزودن ادمین جدید", callback_data="add_new_admin")])
-                
-                await query.edit_message_text(admin_list, reply_markup=InlineKeyboardMarkup(keyboard))
-                logger.info(f"Admin removed: {admin_id_to_remove}")
-            else:
-                await query.answer("❌ این کاربر ادمین نیست.", show_alert=True)
+            admin_list += "\n💡 برای افزودن ادمین جدید، از دکمه زیر استفاده کنید:"
+            keyboard.append(ADD_ADMIN_ROW)
+            
+            await query.edit_message_text(admin_list, reply_markup=InlineKeyboardMarkup(keyboard))
+            logger.info("Admin removed: %s", admin_id_to_remove)
+        else:
+            await self._alert(query, user.id, "❌ این کاربر ادمین نیست.")
+    
+    async def _cb_delchan(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Remove a mandatory channel"""
+        user = update.effective_user
+        if not self.is_admin(user.id):
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
             return
         
-        elif data.startswith("delchan_"):
-            if not self.is_admin(user.id):
-                await query.answer("❌ فقط ادمین‌ها دسترسی دارند.", show_alert=True)
-                return
+        channel_key = payload
+        
+        if channel_key in self.mandatory_channels:
+            removed_channel = self.remove_mandatory_channel(channel_key)
             
-            channel_key = data.replace("delchan_", "")
+            await self._alert(
+                query, user.id,
+                f"✅ کانال حذف شد!\n{removed_channel.get('button_text', 'Unknown')}"
+            )
             
-            if channel_key in self.mandatory_channels:
-                removed_channel = self.mandatory_channels[channel_key]
-                del self.mandatory_channels[channel_key]
-                
-                await query.answer(
-                    f"✅ کانال حذف شد!\n{removed_channel.get('button_text', 'Unknown')}", 
-                    show_alert=True
-                )
-                
-                # Refresh channel list
-                if not self.mandatory_channels:
-                    await query.edit_message_text("✅ کانال حذف شد.\n\n📋 دیگر کانال اجباری وجود ندارد.")
-                else:
-                    message = f"📢 کانال‌های باقی‌مانده ({len(self.mandatory_channels)} عدد):\n\n"
-                    keyboard = []
-                    
-                    for idx, (ch_key, ch_info) in enumerate(self.mandatory_channels.items(), 1):
-                        message += f"{idx}. {ch_info['button_text']}\n"
-                        message += f"   🔗 {ch_info['display']}\n\n"
-                        keyboard.append([InlineKeyboardButton(f"🗑 حذف: {ch_info['button_text']}", callback_data=f"delchan_{ch_key}")])
-                    
-                    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-                
-                logger.info(f"Channel removed: {removed_channel.get('display')}, remaining: {len(self.mandatory_channels)}")
+            # Refresh channel list
+            if not self.mandatory_channels:
+                await query.edit_message_text("✅ کانال حذف شد.\n\n📋 دیگر کانال اجباری وجود ندارد.")
             else:
-                await query.answer("❌ کانال پیدا نشد.", show_alert=True)
+                message, reply_markup = self._render_channel_delete_menu(
+                    f"📢 کانال‌های باقی‌مانده ({len(self.mandatory_channels)} عدد):\n\n"
+                )
+                await query.edit_message_text(message, reply_markup=reply_markup)
+            
+            logger.info("Channel removed: %s, remaining: %s", removed_channel.get('display'), len(self.mandatory_channels))
+        else:
+            await self._alert(query, user.id, "❌ کانال پیدا نشد.")
+    
+    async def _cb_delfile(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Delete a file link"""
+        user = update.effective_user
+        if not self.is_admin(user.id):
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
             return
         
-        elif data.startswith("delfile_"):
-            if not self.is_admin(user.id):
-                await query.answer("❌ فقط ادمین‌ها دسترسی دارند.", show_alert=True)
-                return
-            
-            file_code = data.replace("delfile_", "")
+        file_code = payload
+        
+        if self.remove_file(file_code):
+            await self._alert(query, user.id, f"✅ لینک فایل {file_code} حذف شد!")
             
-            if file_code in self.files:
-                del self.files[file_code]
-                await query.answer(f"✅ لینک فایل {file_code} حذف شد!", show_alert=True)
-                
-                # Refresh file list
-                if not self.files:
-                    await query.edit_message_text("✅ لینک فایل حذف شد.\n\n📋 دیگر لینک فایلی وجود ندارد.")
-                else:
-                    try:
-                        bot_username = (await self.bot.get_me()).username
-                        message = f"🗑 لیست لینک‌های باقی‌مانده ({len(self.files)} عدد):\n\n"
-                        keyboard = []
-                        
-                        for idx, (code, file_info) in enumerate(self.files.items(), 1):
-                            file_count = len(file_info.get('files', []))
-                            caption = file_info.get('caption', 'بدون متن')
-                            if len(caption) > 20:
-                                caption = caption[:20] + "..."
-                            
-                            message += f"{idx}. {code} ({file_count} فایل)\n"
-                            keyboard.append([InlineKeyboardButton(f"🗑 حذف: {code} - {caption}", callback_data=f"delfile_{code}")])
-                            
-                            if idx >= 15:
-                                message += f"\n... و {len(self.files) - 15} لینک دیگر\n"
-                                break
-                        
-                        await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-                    except Exception as e:
-                        await query.edit_message_text("✅ لینک فایل حذف شد.")
-                
-                logger.info(f"File link {file_code} deleted by admin {user.id}")
+            # Refresh file list
+            if not self.files:
+                await query.edit_message_text("✅ لینک فایل حذف شد.\n\n📋 دیگر لینک فایلی وجود ندارد.")
             else:
-                await query.answer("❌ لینک فایل پیدا نشد.", show_alert=True)
+                try:
+                    message, reply_markup = self._render_file_delete_menu(
+                        f"🗑 لیست لینک‌های باقی‌مانده ({len(self.files)} عدد):\n\n"
+                    )
+                    await query.edit_message_text(message, reply_markup=reply_markup)
+                except Exception as e:
+                    await query.edit_message_text("✅ لینک فایل حذف شد.")
+            
+            logger.info("File link %s deleted by admin %s", file_code, user.id)
+        else:
+            await self._alert(query, user.id, "❌ لینک فایل پیدا نشد.")
+    
+    async def _cb_unblock(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Unblock a user"""
+        user = update.effective_user
+        if not self.is_admin(user.id):
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
             return
         
-        elif data.startswith("unblock_"):
-            if not self.is_admin(user.id):
-                await query.answer("❌ فقط ادمین‌ها دسترسی دارند.", show_alert=True)
-                return
+        user_id_to_unblock = int(payload)
+        
+        if user_id_to_unblock in self.users:
+            user_info = self.users[user_id_to_unblock]
+            user_info.is_blocked = False
+            user_info.blocked_at = None
+            self.save_user(user_id_to_unblock)
             
-            user_id_to_unblock = int(data.replace("unblock_", ""))
+            await self._alert(query, user.id, f"✅ کاربر {user_id_to_unblock} آنبلاک شد!")
             
-            if user_id_to_unblock in self.users:
-                self.users[user_id_to_unblock]['is_blocked'] = False
-                self.users[user_id_to_unblock].pop('blocked_at', None)
-                
-                await query.answer(f"✅ کاربر {user_id_to_unblock} آنبلاک شد!", show_alert=True)
-                
-                # Refresh blocked users list
-                blocked_users = [u for u in self.users.values() if u.get('is_blocked', False)]
-                
-                if not blocked_users:
-                    await query.edit_message_text("✅ کاربر آنبلاک شد.\n\n📋 دیگر کاربر بلاک شده‌ای وجود ندارد.")
-                else:
-                    message = f"🚫 کاربران بلاک شده باقی‌مانده ({len(blocked_users)} نفر):\n\n"
-                    keyboard = []
-                    
-                    for u in blocked_users[:20]:
-                        username_display = f"@{u.get('username', 'ندارد')}"
-                        message += f"• {u.get('first_name', 'Unknown')} ({username_display}) - ID: {u['user_id']}\n"
-                        keyboard.append([InlineKeyboardButton(
-                            f"✅ آنبلاک: {u.get('first_name', 'Unknown')} ({u['user_id']})", 
-                            callback_data=f"unblock_{u['user_id']}"
-                        )])
-                    
-                    if len(blocked_users) > 20:
-                        message += f"\n... و {len(blocked_users) - 20} نفر دیگر"
-                    
-                    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-                
-                logger.info(f"User unblocked: {user_id_to_unblock}")
+            # Refresh blocked users list
+            blocked_count = len(self._blocked_user_ids)
+            
+            if not blocked_count:
+                await query.edit_message_text("✅ کاربر آنبلاک شد.\n\n📋 دیگر کاربر بلاک شده‌ای وجود ندارد.")
             else:
-                await query.answer("❌ کاربر پیدا نشد.", show_alert=True)
+                message, reply_markup = self._render_blocked_users(
+                    f"🚫 کاربران بلاک شده باقی‌مانده ({blocked_count} نفر):\n\n"
+                )
+                await query.edit_message_text(message, reply_markup=reply_markup)
+            
+            logger.info("User unblocked: %s", user_id_to_unblock)
+        else:
+            await self._alert(query, user.id, "❌ کاربر پیدا نشد.")
+    
+    async def _cb_redownload(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """Send a link's files again after they expired"""
+        user = update.effective_user
+        file_code = payload
+        
+        if await self._refuse_for_spam(query, user.id):
             return
+
+        # Check membership again with force recheck
+        if not self.mandatory_channels or self.is_admin(user.id):
+            is_member, not_joined_channels = True, []
+        else:
+            is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
         
-        # Handle file upload flow
-        if data == "add_more_files":
+        if not is_member:
+            await self._alert(query, user.id, "⚠️ هنوز در همه کانال‌ها عضو نشده‌اید!")
+            
+            # Show join buttons again
             await query.edit_message_text(
-                f"📤 در انتظار فایل بعدی...\n\n"
-                f"📦 تعداد فایل‌های دریافت شده: {len(context.user_data.get('temp_files', []))}\n\n"
-                "لطفاً فایل بعدی را ارسال کنید."
+                "⚠️ برای دریافت فایل، ابتدا باید در کانال‌ها/گروه‌های زیر عضو شوید:\n\n"
+                "👇 روی دکمه‌های زیر کلیک کنید و عضو شوید، سپس «عضو شدم ✅» را بزنید:",
+                reply_markup=self._build_join_markup(not_joined_channels, file_code)
             )
             return
         
-        elif data == "finish_files":
-            if 'temp_files' not in context.user_data or not context.user_data['temp_files']:
-                await query.edit_message_text("❌ خطا: فایلی یافت نشد.")
-                context.user_data.clear()
+        file_group = self.files.get(file_code)
+        if not file_group:
+            await self._alert(query, user.id, "❌ این لینک وجود ندارد.")
+            return
+        
+        await self.send_files_to_user(user.id, file_group, file_code)
+        await query.answer("✅ در حال ارسال مجدد...", show_alert=False)
+    
+    async def _cb_check(self, update: Update, context: ContextTypes.DEFAULT_TYPE, query, payload: str):
+        """User says they joined - recheck membership and send the files"""
+        user = update.effective_user
+        file_code = payload
+        
+        if await self._refuse_for_spam(query, user.id):
+            return
+        
+        # Check membership again with force recheck
+        is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
+        trust_warning = None  # shown instead of the plain answer once the files are sent
+        
+        if not_joined_channels:
+            # Separate auto-verify (bot is admin) vs trust-based (bot not admin)
+            auto_verify_failed = []
+            trust_based_channels = []
+            
+            for channel in not_joined_channels:
+                channel_key = str(channel.get('chat_id') or channel.get('identifier'))
+                if channel.get('can_auto_verify'):
+                    # Bot IS admin - auto verification failed
+                    auto_verify_failed.append(channel)
+                else:
+                    # Bot is NOT admin - trust user but warn them
+                    trust_based_channels.append(channel)
+                    # Mark as joined (trust-based)
+                    self.mark_user_joined_channel(user.id, channel_key)
+            
+            # If there are auto-verify failures, user MUST join
+            if auto_verify_failed:
+                # Build list of channels not joined
+                channel_names = "\n".join([f"• {ch['button_text']}" for ch in auto_verify_failed])
+                await self._alert(
+                    query, user.id,
+                    f"❌ شما هنوز در این کانال‌ها عضو نیستید:\n\n{channel_names}\n\n"
+                    "لطفاً ابتدا عضو شوید و سپس دوباره «عضو شدم ✅» را بزنید."
+                )
+                logger.info("User %s failed auto-verify for %s channels", user.id, len(auto_verify_failed))
                 return
             
-            context.user_data['awaiting'] = 'caption_for_files'
-            keyboard = [[InlineKeyboardButton("🚫 بدون متن", callback_data="no_caption_files")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # If only trust-based channels remain, allow and warn with the answer
+            if trust_based_channels:
+                channel_names = "\n".join([f"• {ch['button_text']}" for ch in trust_based_channels])
+                trust_warning = (
+                    f"✅ عضویت شما تایید شد!\n\n"
+                    f"⚠️ توجه: لطفاً مطمئن شوید در این کانال‌ها عضو هستید:\n{channel_names}"
+                )
+                logger.info("User %s verified via trust for %s channels", user.id, len(trust_based_channels))
             
-            await query.edit_message_text(
-                f"✅ {len(context.user_data['temp_files'])} فایل دریافت شد!\n\n"
-                "📝 لطفاً یک متن واحد برای همه فایل‌ها ارسال کنید:\n\n"
-                "یا روی دکمه «بدون متن» کلیک کنید.",
-                reply_markup=reply_markup
+            is_member = True
+        
+        file_group = self.files.get(file_code)
+        if not file_group:
+            await self._alert(query, user.id, "❌ این لینک وجود ندارد.")
+            return
+        
+        # Send files
+        await self.send_files_to_user(user.id, file_group, file_code)
+        if trust_warning:
+            await self._alert(query, user.id, trust_warning)
+        else:
+            await query.answer("✅ در حال ارسال فایل‌ها...", show_alert=False)
+        
+        # Update message
+        try:
+            await query.edit_message_text("✅ فایل‌ها ارسال شدند! لطفاً پیام‌های بالا را چک کنید.")
+        except:
+            pass
+        
+        logger.info("Files %s sent to user %s", file_code, user.id)
+    
+    @clears_state
+    async def _text_broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Queue a broadcast of the admin's text to all active users"""
+        if not self.is_admin(user.id):
+            return
+        
+        pending = self.broadcast_queue.qsize()
+        await self.broadcast_queue.put((user.id, text))
+        if pending:
+            await update.message.reply_text(
+                f"📥 پیام در صف ارسال قرار گرفت ({pending} ارسال همگانی جلوتر از آن است).\n\n"
+                "گزارش پس از پایان ارسال برای شما فرستاده می‌شود."
             )
+        else:
+            await update.message.reply_text("📤 در حال ارسال پیام به همه کاربران...")
+    
+    async def _text_search_user_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Show a user's profile and download count"""
+        if not self.is_admin(user.id):
             return
         
-        elif data == "cancel_upload":
+        try:
+            search_user_id = int(text)
+        except ValueError:
+            await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
+            return
+        
+        if search_user_id not in self.users:
+            await update.message.reply_text("❌ این کاربر یافت نشد.")
             context.user_data.clear()
-            await query.edit_message_text(
-                "🗑 آپلود لغو شد و همه فایل‌ها پاک شدند."
-            )
             return
         
-        elif data == "no_caption_files":
-            if 'temp_files' not in context.user_data or not context.user_data['temp_files']:
-                await query.edit_message_text("❌ خطا: فایلی یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            context.user_data['caption'] = None
-            context.user_data['awaiting'] = 'delete_time'
-            
-            await query.edit_message_text(
-                "⏱️ چه مدت بعد محتوا پاک شود؟\n\n"
-                "لطفاً یک عدد بین 5 تا 30 (ثانیه) وارد کنید:\n\n"
-                "مثال: 10"
-            )
+        user_info = self.users[search_user_id]
+        downloads = self.get_user_downloads(search_user_id)
+        
+        message = f"👤 اطلاعات کاربر:\n\n"
+        message += f"🆔 آیدی: {search_user_id}\n"
+        message += f"👤 نام: {user_info.first_name}\n"
+        message += f"📧 یوزرنیم: @{user_info.username}\n"
+        message += f"⏰ آخرین بازدید: {format_timestamp(user_info.last_seen)}\n"
+        message += f"📥 تعداد دانلودها: {len(downloads)}\n"
+        
+        # Status
+        if user_info.is_blocked:
+            message += f"🚫 وضعیت: بلاک شده توسط ادمین\n"
+        elif user_info.is_bot_blocked:
+            message += f"⛔ وضعیت: بات را بلاک کرده\n"
+        else:
+            message += f"✅ وضعیت: فعال\n"
+        
+        keyboard = [[InlineKeyboardButton("📥 مشاهده تاریخچه دانلود", callback_data=f"viewhist_{search_user_id}")]]
+        
+        await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+        context.user_data.clear()
+    
+    @clears_state
+    async def _text_user_caption_to_admin(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Forward the user's pending file to admins with this caption"""
+        temp_file = context.user_data.get('temp_user_file')
+        if temp_file is None:
+            await update.message.reply_text("❌ خطا: فایلی یافت نشد. لطفاً دوباره تلاش کنید.")
+            return
+        
+        user_info = {
+            'user_id': user.id,
+            'username': user.username,
+            'first_name': user.first_name
+        }
+        
+        await self.forward_to_admins(
+            message_type=temp_file.file_type,
+            content=text,
+            user_info=user_info,
+            telegram_file_id=temp_file.telegram_file_id
+        )
+        
+        await update.message.reply_text(
+            "✅ پیام شما با موفقیت برای ادمین ارسال شد!\n\n"
+            "⏳ لطفاً منتظر پاسخ ادمین باشید.",
+            reply_markup=self.get_user_keyboard()
+        )
+    
+    async def _text_post_caption(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Store the channel post caption and ask for the URL"""
+        if not self.is_admin(user.id):
+            return
+        
+        context.user_data['post_caption'] = text
+        context.user_data['awaiting'] = 'post_url'
+        
+        await update.message.reply_text(
+            "✅ متن پست دریافت شد!\n\n"
+            "🔗 حالا لینک (URL) را وارد کنید:\n\n"
+            "مثال: https://t.me/yourchannel"
+        )
+    
+    async def _text_post_url(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Store the channel post URL and ask for the button text"""
+        if not self.is_admin(user.id):
+            return
+        
+        # Validate URL
+        if not text.startswith('http://') and not text.startswith('https://'):
+            await update.message.reply_text("❌ لینک نامعتبر! لطفاً یک URL معتبر وارد کنید که با http:// یا https:// شروع شود.")
             return
         
-        # Handle user actions
-        elif data == "cancel_user_send":
+        context.user_data['post_url'] = text
+        context.user_data['awaiting'] = 'post_button_text'
+        
+        await update.message.reply_text(
+            "✅ لینک دریافت شد!\n\n"
+            "📝 حالا متن روی دکمه را وارد کنید:\n\n"
+            "مثال: عضویت در کانال"
+        )
+    
+    async def _text_post_button_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Store the button text and ask which channel to post to"""
+        if not self.is_admin(user.id):
+            return
+        
+        context.user_data['post_button_text'] = text
+        context.user_data['awaiting'] = None
+        
+        # Show list of channels to select
+        if not self.detected_channels:
+            await update.message.reply_text("❌ هیچ کانالی شناسایی نشده است!")
             context.user_data.clear()
-            keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
-            await query.edit_message_text(
-                f"👋 سلام {user.first_name}\n\n"
-                "برای دریافت فایل‌ها، لینک را از ادمین دریافت کنید.\n\n"
-                "یا می‌توانید از دکمه زیر برای ارتباط با مدیر استفاده کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
             return
         
-        elif data == "no_user_caption":
-            if 'temp_user_file' not in context.user_data:
-                await query.edit_message_text("❌ خطا: فایلی یافت نشد. لطفاً دوباره تلاش کنید.")
-                context.user_data.clear()
-                return
-            
-            temp_file = context.user_data['temp_user_file']
-            user_info = {
-                'user_id': user.id,
-                'username': user.username,
-                'first_name': user.first_name
-            }
-            
-            await self.forward_to_admins(
-                message_type=temp_file['file_type'],
-                content=None,
-                user_info=user_info,
-                telegram_file_id=temp_file['telegram_file_id']
-            )
-            
-            await query.edit_message_text(
-                "✅ فایل شما با موفقیت برای ادمین ارسال شد!\n\n"
-                "⏳ لطفاً منتظر پاسخ ادمین باشید."
-            )
-            
+        message = "📢 انتخاب کانال برای ارسال پست:\n\n"
+        keyboard = []
+        
+        for chat_id, ch_info in self.detected_channels.items():
+            message += f"• {ch_info['title']} ({chat_id})\n"
+            keyboard.append([InlineKeyboardButton(
+                f"📢 {ch_info['title']}",
+                callback_data=f"select_channel_{chat_id}"
+            )])
+        
+        message += "\n👇 روی کانال مورد نظر کلیک کنید:"
+        
+        await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    async def _text_caption_for_files(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Store the caption for the uploaded files and ask for the deletion delay"""
+        if not context.user_data.get('temp_files'):
+            await update.message.reply_text("❌ خطا: فایلی یافت نشد.")
             context.user_data.clear()
             return
         
-        elif data.startswith("redownload_"):
-            file_code = data.replace("redownload_", "")
-            
-            # Skip spam check for admins
-            if not self.is_admin(user.id):
-                is_blocked, remaining = self.is_temp_blocked(user.id)
-                if is_blocked:
-                    await query.answer(f"⛔ مسدود شده‌اید. {remaining} ثانیه صبر کنید.", show_alert=True)
-                    return
-                
-                is_spam, wait_time = self.check_spam(user.id)
-                if is_spam:
-                    await query.answer(f"⚠️ لطفاً {wait_time} ثانیه صبر کنید.", show_alert=True)
-                    return
-
-            # Check membership again with force recheck
-            is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
-            
-            if not is_member:
-                await query.answer("⚠️ هنوز در همه کانال‌ها عضو نشده‌اید!", show_alert=True)
-                
-                # Show join buttons again
-                keyboard = []
-                for channel in not_joined_channels:
-                    channel_key = str(channel.get('chat_id') or channel.get('identifier'))
-                    channel_url = self.get_channel_url(channel)
-                    
-                    # Always use URL button - direct link
-                    keyboard.append([InlineKeyboardButton(
-                        channel['button_text'],
-                        url=channel_url
-                    )])
-                
-                keyboard.append([InlineKeyboardButton(
-                    "✅ عضو شدم",
-                    callback_data=f"check_{file_code}"
-                )])
-                
-                await query.edit_message_text(
-                    "⚠️ برای دریافت فایل، ابتدا باید در کانال‌ها/گروه‌های زیر عضو شوید:\n\n"
-                    "👇 روی دکمه‌های زیر کلیک کنید و عضو شوید، سپس «عضو شدم ✅» را بزنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-                return
-            
-            if file_code not in self.files:
-                await query.answer("❌ این لینک وجود ندارد.", show_alert=True)
-                return
-            
-            await self.send_files_to_user(user.id, self.files[file_code], file_code)
-            await query.answer("✅ در حال ارسال مجدد...", show_alert=False)
+        context.user_data['caption'] = text
+        context.user_data['awaiting'] = 'delete_time'
+        
+        await update.message.reply_text(
+            "⏱️ چه مدت بعد محتوا پاک شود؟\n\n"
+            "لطفاً یک عدد بین 5 تا 30 (ثانیه) وارد کنید:\n\n"
+            "مثال: 10"
+        )
+    
+    async def _text_delete_time(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Store the deletion delay and create the share link"""
+        if not context.user_data.get('temp_files'):
+            await update.message.reply_text("❌ خطا: فایلی یافت نشد.")
+            context.user_data.clear()
+            return
+        
+        text = text.strip()
+        if not text.isdecimal():
+            await update.message.reply_text("❌ لطفاً یک عدد معتبر وارد کنید.")
+            return
+        
+        delete_seconds = int(text)
+        if delete_seconds < 5 or delete_seconds > 30:
+            await update.message.reply_text("❌ لطفاً عددی بین 5 تا 30 وارد کنید.")
+            return
+        
+        # Generate unique code
+        unique_code = self._tokens.next_token()
+        while unique_code in self.files:  # 64 random bits, so this practically never loops
+            unique_code = self._tokens.next_token()
+        unique_code = sys.intern(unique_code)
+        
+        # Save file group
+        self.save_file(unique_code, FileInfo(
+            files=context.user_data['temp_files'],
+            caption=context.user_data.get('caption'),
+            delete_seconds=delete_seconds,
+            created_at=time.time(),
+            admin_id=user.id
+        ))
+        
+        await update.message.reply_text(LINK_CREATED_TEMPLATE.format_map({
+            'share_link': f"https://t.me/{self.bot_username}?start={unique_code}",
+            'file_count': len(context.user_data['temp_files']),
+            'caption': context.user_data.get('caption') or 'بدون متن',
+            'delete_seconds': delete_seconds,
+        }))
+        
+        context.user_data.clear()
+        logger.info("File link created: %s by admin %s", unique_code, user.id)
+    
+    async def _text_channel_link(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Resolve a mandatory channel link and ask for its button text"""
+        if not self.is_admin(user.id):
             return
         
-        elif data.startswith("check_"):
-            file_code = data.replace("check_", "")
-            
-            # Skip spam check for admins
-            if not self.is_admin(user.id):
-                is_blocked, remaining = self.is_temp_blocked(user.id)
-                if is_blocked:
-                    await query.answer(f"⛔ مسدود شده‌اید. {remaining} ثانیه صبر کنید.", show_alert=True)
-                    return
-                
-                is_spam, wait_time = self.check_spam(user.id)
-                if is_spam:
-                    await query.answer(f"⚠️ لطفاً {wait_time} ثانیه صبر کنید.", show_alert=True)
-                    return
-            
-            # Check membership again with force recheck
-            is_member, not_joined_channels = await self.check_membership(user.id, force_recheck=True)
-            
-            if not_joined_channels:
-                # Separate auto-verify (bot is admin) vs trust-based (bot not admin)
-                auto_verify_failed = []
-                trust_based_channels = []
-                
-                for channel in not_joined_channels:
-                    channel_key = str(channel.get('chat_id') or channel.get('identifier'))
-                    if channel.get('can_auto_verify'):
-                        # Bot IS admin - auto verification failed
-                        auto_verify_failed.append(channel)
-                    else:
-                        # Bot is NOT admin - trust user but warn them
-                        trust_based_channels.append(channel)
-                        # Mark as joined (trust-based)
-                        self.mark_user_joined_channel(user.id, channel_key)
-                
-                # If there are auto-verify failures, user MUST join
-                if auto_verify_failed:
-                    # Build list of channels not joined
-                    channel_names = "\n".join([f"• {ch['button_text']}" for ch in auto_verify_failed])
-                    await query.answer(
-                        f"❌ شما هنوز در این کانال‌ها عضو نیستید:\n\n{channel_names}\n\n"
-                        "لطفاً ابتدا عضو شوید و سپس دوباره «عضو شدم ✅» را بزنید.",
-                        show_alert=True
-                    )
-                    logger.info(f"User {user.id} failed auto-verify for {len(auto_verify_failed)} channels")
-                    return
-                
-                # If only trust-based channels remain, show warning then allow
-                if trust_based_channels:
-                    channel_names = "\n".join([f"• {ch['button_text']}" for ch in trust_based_channels])
-                    await query.answer(
-                        f"✅ عضویت شما تایید شد!\n\n"
-                        f"⚠️ توجه: لطفاً مطمئن شوید در این کانال‌ها عضو هستید:\n{channel_names}",
-                        show_alert=True
-                    )
-                    logger.info(f"User {user.id} verified via trust for {len(trust_based_channels)} channels")
-                
-                is_member = True
-            
-            if file_code not in self.files:
-                await query.answer("❌ این لینک وجود ندارد.", show_alert=True)
-                return
-            
-            # Send files
-            await self.send_files_to_user(user.id, self.files[file_code], file_code)
-            await query.answer("✅ در حال ارسال فایل‌ها...", show_alert=False)
-            
-            # Update message
-            try:
-                await query.edit_message_text("✅ فایل‌ها ارسال شدند! لطفاً پیام‌های بالا را چک کنید.")
-            except:
-                pass
-            
-            logger.info(f"Files {file_code} sent to user {user.id}")
+        channel_info = self.extract_channel_info(text)
+        
+        if not channel_info:
+            await update.message.reply_text("❌ فرمت نامعتبر! لطفاً دوباره تلاش کنید.")
+            return
+        
+        # Check if bot is admin and get actual chat_id + invite_link
+        is_admin, chat_id, invite_link = await self.check_if_bot_is_admin(channel_info['identifier'])
+        channel_info['can_auto_verify'] = is_admin
+        if chat_id:
+            channel_info['chat_id'] = chat_id
+        if invite_link:
+            channel_info['invite_link'] = invite_link
+        
+        context.user_data['temp_channel'] = channel_info
+        context.user_data['awaiting'] = 'channel_button_text'
+        
+        verify_status = "✅ بات ادمین است (چک خودکار)" if is_admin else "⚠️ بات ادمین نیست (بر اساس اعتماد)"
+        
+        response_text = (
+            f"✅ کانال شناسایی شد!\n\n"
+            f"🔗 {channel_info['display']}\n"
+            f"🔍 {verify_status}\n"
+        )
+        
+        if invite_link:
+            response_text += f"📎 لینک دعوت: {invite_link}\n"
+        
+        response_text += f"\n📝 حالا متن دکمه را وارد کنید:\n\nمثال: عضویت در کانال اصلی"
+        
+        await update.message.reply_text(response_text)
+    
+    @clears_state
+    async def _text_channel_button_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Save a mandatory channel with its button text"""
+        if not self.is_admin(user.id):
+            return
+        
+        if 'temp_channel' not in context.user_data:
+            await update.message.reply_text("❌ خطا: اطلاعات کانال یافت نشد.")
+            return
+        
+        channel_info = context.user_data['temp_channel']
+        channel_info['button_text'] = text
+        
+        # Save channel - use chat_id as key if available, otherwise identifier
+        channel_key = str(channel_info.get('chat_id') or channel_info['identifier'])
+        self.add_mandatory_channel(channel_key, channel_info)
+        
+        verify_status = "✅ چک خودکار" if channel_info.get('can_auto_verify') else "🤝 بر اساس اعتماد"
+        
+        response_text = (
+            f"✅ کانال با موفقیت اضافه شد!\n\n"
+            f"📢 متن دکمه: {text}\n"
+            f"🔗 لینک: {channel_info['display']}\n"
+        )
+        
+        if channel_info.get('invite_link'):
+            response_text += f"📎 لینک دعوت: {channel_info['invite_link']}\n"
+        
+        response_text += f"🔍 حالت: {verify_status}\n\nتعداد کانال‌های اجباری: {len(self.mandatory_channels)}"
+        
+        await update.message.reply_text(response_text)
+        
+        logger.info("Channel added: %s", channel_info['display'])
+    
+    @clears_state
+    async def _text_auto_channel_button_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Save an auto-detected channel as mandatory with its button text"""
+        if user.id != MAIN_ADMIN_ID:
+            return
+        
+        if 'temp_channel_from_auto' not in context.user_data:
+            await update.message.reply_text("❌ خطا: اطلاعات کانال یافت نشد.")
+            return
+        
+        channel_info = context.user_data['temp_channel_from_auto']
+        channel_info['button_text'] = text
+        channel_info['can_auto_verify'] = True  # Auto-detected channels are always admin
+        
+        # Save to mandatory channels
+        channel_key = str(channel_info['chat_id'])
+        self.add_mandatory_channel(channel_key, channel_info)
+        
+        response_text = (
+            f"✅ کانال با موفقیت به جوین اجباری اضافه شد!\n\n"
+            f"📢 نام: {channel_info['title']}\n"
+            f"📝 متن دکمه: {text}\n"
+            f"🆔 Chat ID: {channel_info['chat_id']}\n"
+        )
+        
+        if channel_info.get('invite_link'):
+            response_text += f"📎 لینک دعوت: {channel_info['invite_link']}\n"
+        
+        response_text += f"🔍 حالت: چک خودکار ✅\n\nتعداد کانال‌های اجباری: {len(self.mandatory_channels)}"
+        
+        await update.message.reply_text(response_text)
+        
+        logger.info("Auto-detected channel added to mandatory: %s", channel_info['title'])
+    
+    async def _text_target_user_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Pick the user to send a private message to"""
+        if not self.is_admin(user.id):
+            return
+        
+        try:
+            target_user_id = int(text)
+        except ValueError:
+            await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
+            return
+        
+        if target_user_id not in self.users:
+            await update.message.reply_text("❌ این کاربر یافت نشد.")
+            return
+        
+        context.user_data['target_user_id'] = target_user_id
+        context.user_data['awaiting'] = 'pm_message'
+        
+        target_user = self.users[target_user_id]
+        await update.message.reply_text(
+            f"✅ کاربر پیدا شد!\n\n"
+            f"👤 نام: {target_user.first_name}\n"
+            f"🆔 آیدی: {target_user_id}\n\n"
+            f"📝 حالا پیام خود را ارسال کنید:"
+        )
+    
+    @clears_state
+    async def _text_pm_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Send the admin's private message to the chosen user"""
+        if not self.is_admin(user.id):
+            return
+        
+        if 'target_user_id' not in context.user_data:
+            await update.message.reply_text("❌ خطا: کاربر هدف یافت نشد.")
+            return
+        
+        target_user_id = context.user_data['target_user_id']
+        
+        try:
+            await self.bot.send_message(
+                chat_id=target_user_id,
+                text=f"💬 پیام از ادمین:\n\n{text}"
+            )
+            await update.message.reply_text("✅ پیام با موفقیت ارسال شد!")
+        except Forbidden:
+            await self.mark_user_blocked_bot(target_user_id)
+            await update.message.reply_text("❌ کاربر بات را بلاک کرده است.")
+        except Exception as e:
+            logger.error("Error sending PM: %s", e)
+            await update.message.reply_text("❌ خطا در ارسال پیام.")
+    
+    async def _text_block_user_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Block a user by id"""
+        if not self.is_admin(user.id):
+            return
+        
+        try:
+            user_id_to_block = int(text)
+        except ValueError:
+            await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
+            return
+        
+        if user_id_to_block not in self.users:
+            await update.message.reply_text("❌ این کاربر یافت نشد.")
+            return
+        
+        user_info = self.users[user_id_to_block]
+        user_info.is_blocked = True
+        user_info.blocked_at = time.time()
+        self.save_user(user_id_to_block)
+        
+        await update.message.reply_text(
+            f"✅ کاربر {user_id_to_block} بلاک شد!\n\n"
+            f"👤 نام: {user_info.first_name}"
+        )
+        
+        context.user_data.clear()
+        logger.info("User blocked: %s", user_id_to_block)
+    
+    async def _text_new_admin_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, text: str):
+        """Add a new admin by id"""
+        if user.id != MAIN_ADMIN_ID:
+            return
+        
+        try:
+            new_admin_id = int(text)
+        except ValueError:
+            await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
+            return
+        
+        if new_admin_id in self.admins:
+            await update.message.reply_text("❌ این کاربر قبلاً ادمین است.")
+            return
+        
+        self.save_admin(new_admin_id, {
+            'added_at': time.time(),
+            'added_by': user.id
+        })
+        
+        await update.message.reply_text(
+            f"✅ کاربر {new_admin_id} به عنوان ادمین اضافه شد!\n\n"
+            f"تعداد ادمین‌ها: {len(self.admins)}"
+        )
+        
+        context.user_data.clear()
+        logger.info("New admin added: %s by %s", new_admin_id, user.id)
     
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages - ONLY IN PRIVATE CHAT"""
         # CRITICAL FIX: Only respond in private chat
         if update.effective_chat.type != ChatType.PRIVATE:
-            logger.info(f"Ignoring text message in non-private chat")
+            logger.info("Ignoring text message in non-private chat")
             return
         
         user = update.effective_user
@@ -1511,64 +2434,50 @@ class TelegramBot:
         if self.is_admin(user.id):
             # Users menu
             if text == "👥 کاربران":
-                keyboard = [
-                    [InlineKeyboardButton("👥 کاربران فعال", callback_data="menu_active_users")],
-                    [InlineKeyboardButton("👤 جستجوی کاربر", callback_data="menu_search_user")],
-                    [InlineKeyboardButton("🔨 بلاک کاربر", callback_data="menu_block_user")],
-                    [InlineKeyboardButton("✅ آنبلاک کاربر", callback_data="menu_unblock_user")]
-                ]
                 await update.message.reply_text(
                     "👥 منوی مدیریت کاربران:\n\n"
                     "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=USERS_MENU_MARKUP
                 )
                 return
             
             # Files menu
             elif text == "📁 فایل‌ها":
-                keyboard = [
-                    [InlineKeyboardButton("📋 لیست فایل‌ها", callback_data="menu_list_files")],
-                    [InlineKeyboardButton("🗑 حذف لینک فایل", callback_data="menu_delete_file")]
-                ]
                 await update.message.reply_text(
                     "📁 منوی مدیریت فایل‌ها:\n\n"
                     "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=FILES_MENU_MARKUP
                 )
                 return
             
             # PM menu
             elif text == "📨 ارسال PM":
-                keyboard = [
-                    [InlineKeyboardButton("📤 ارسال همگانی", callback_data="menu_broadcast")],
-                    [InlineKeyboardButton("📩 پیام به کاربر", callback_data="menu_pm_user")]
-                ]
                 await update.message.reply_text(
                     "📨 منوی ارسال پیام:\n\n"
                     "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=PM_MENU_MARKUP
                 )
                 return
             
             # Force join menu
             elif text == "🔒 جوین اجباری":
-                keyboard = [
-                    [InlineKeyboardButton("📢 کانال‌های اجباری", callback_data="menu_list_channels")],
-                    [InlineKeyboardButton("➕ افزودن کانال", callback_data="menu_add_channel")],
-                    [InlineKeyboardButton("➖ حذف کانال", callback_data="menu_remove_channel")]
-                ]
+                reply_markup = FORCE_JOIN_MENU_MARKUP
                 
                 # Add detected channels button if any
                 if self.detected_channels:
-                    keyboard.insert(1, [InlineKeyboardButton(
-                        f"🔍 کانال‌های شناسایی شده ({len(self.detected_channels)})",
-                        callback_data="menu_detected_channels"
-                    )])
+                    reply_markup = InlineKeyboardMarkup([
+                        FORCE_JOIN_MENU_ROWS[0],
+                        [InlineKeyboardButton(
+                            f"🔍 کانال‌های شناسایی شده ({len(self.detected_channels)})",
+                            callback_data="menu_detected_channels"
+                        )],
+                        *FORCE_JOIN_MENU_ROWS[1:]
+                    ])
                 
                 await update.message.reply_text(
                     "🔒 منوی جوین اجباری:\n\n"
                     "لطفاً یکی از گزینه‌های زیر را انتخاب کنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=reply_markup
                 )
                 return
             
@@ -1582,11 +2491,10 @@ class TelegramBot:
                     return
                 
                 context.user_data['awaiting'] = 'post_photo'
-                keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
                 await update.message.reply_text(
                     "📢 ارسال پست به کانال\n\n"
                     "📸 لطفاً عکس پست را ارسال کنید:",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
+                    reply_markup=CANCEL_MARKUP
                 )
                 return
             
@@ -1608,7 +2516,7 @@ class TelegramBot:
                         keyboard.append([InlineKeyboardButton(f"🗑 حذف {admin_id}", callback_data=f"removeadmin_{admin_id}")])
                 
                 admin_list += "\n💡 برای افزودن ادمین جدید، از دکمه زیر استفاده کنید:"
-                keyboard.append([InlineKeyboardButton("➕ افزودن ادمین جدید", callback_data="add_new_admin")])
+                keyboard.append(ADD_ADMIN_ROW)
                 
                 await update.message.reply_text(admin_list, reply_markup=InlineKeyboardMarkup(keyboard))
                 return
@@ -1627,11 +2535,10 @@ class TelegramBot:
                 user_info=user_info
             )
             
-            keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
             await update.message.reply_text(
                 "✅ پیام شما با موفقیت برای ادمین ارسال شد!\n\n"
                 "⏳ لطفاً منتظر پاسخ ادمین باشید.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=self.get_user_keyboard()
             )
             
             context.user_data.clear()
@@ -1640,456 +2547,53 @@ class TelegramBot:
         if 'awaiting' not in context.user_data:
             return
         
-        awaiting = context.user_data['awaiting']
-        
-        if awaiting == 'broadcast_message':
-            if not self.is_admin(user.id):
-                return
-            
-            await update.message.reply_text("📤 در حال ارسال پیام به همه کاربران...")
-            asyncio.create_task(self.broadcast_message(text, user.id))
-            context.user_data.clear()
-            return
-        
-        elif awaiting == 'search_user_id':
-            if not self.is_admin(user.id):
-                return
-            
-            try:
-                search_user_id = int(text)
-            except ValueError:
-                await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
-                return
-            
-            if search_user_id not in self.users:
-                await update.message.reply_text("❌ این کاربر یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            user_info = self.users[search_user_id]
-            downloads = self.get_user_downloads(search_user_id)
-            
-            message = f"👤 اطلاعات کاربر:\n\n"
-            message += f"🆔 آیدی: {search_user_id}\n"
-            message += f"👤 نام: {user_info.get('first_name', 'Unknown')}\n"
-            message += f"📧 یوزرنیم: @{user_info.get('username', 'ندارد')}\n"
-            message += f"⏰ آخرین بازدید: {user_info.get('last_seen', 'نامشخص')[:16]}\n"
-            message += f"📥 تعداد دانلودها: {len(downloads)}\n"
-            
-            # Status
-            if user_info.get('is_blocked'):
-                message += f"🚫 وضعیت: بلاک شده توسط ادمین\n"
-            elif user_info.get('is_bot_blocked'):
-                message += f"⛔ وضعیت: بات را بلاک کرده\n"
-            else:
-                message += f"✅ وضعیت: فعال\n"
-            
-            keyboard = [[InlineKeyboardButton("📥 مشاهده تاریخچه دانلود", callback_data=f"viewhist_{search_user_id}")]]
-            
-            await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-            context.user_data.clear()
-            return
-        
-        elif awaiting == 'user_caption_to_admin':
-            if 'temp_user_file' not in context.user_data:
-                await update.message.reply_text("❌ خطا: فایلی یافت نشد. لطفاً دوباره تلاش کنید.")
-                context.user_data.clear()
-                return
-            
-            temp_file = context.user_data['temp_user_file']
-            user_info = {
-                'user_id': user.id,
-                'username': user.username,
-                'first_name': user.first_name
-            }
-            
-            await self.forward_to_admins(
-                message_type=temp_file['file_type'],
-                content=text,
-                user_info=user_info,
-                telegram_file_id=temp_file['telegram_file_id']
-            )
-            
-            keyboard = [[InlineKeyboardButton("📞 ارتباط با مدیر", callback_data="contact_admin")]]
-            await update.message.reply_text(
-                "✅ پیام شما با موفقیت برای ادمین ارسال شد!\n\n"
-                "⏳ لطفاً منتظر پاسخ ادمین باشید.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            
-            context.user_data.clear()
-            return
-        
-        elif awaiting == 'post_caption':
-            if not self.is_admin(user.id):
-                return
-            
-            context.user_data['post_caption'] = text
-            context.user_data['awaiting'] = 'post_url'
-            
-            await update.message.reply_text(
-                "✅ متن پست دریافت شد!\n\n"
-                "🔗 حالا لینک (URL) را وارد کنید:\n\n"
-                "مثال: https://t.me/yourchannel"
-            )
-            return
-        
-        elif awaiting == 'post_url':
-            if not self.is_admin(user.id):
-                return
-            
-            # Validate URL
-            if not text.startswith('http://') and not text.startswith('https://'):
-                await update.message.reply_text("❌ لینک نامعتبر! لطفاً یک URL معتبر وارد کنید که با http:// یا https:// شروع شود.")
-                return
-            
-            context.user_data['post_url'] = text
-            context.user_data['awaiting'] = 'post_button_text'
-            
-            await update.message.reply_text(
-                "✅ لینک دریافت شد!\n\n"
-                "📝 حالا متن روی دکمه را وارد کنید:\n\n"
-                "مثال: عضویت در کانال"
-            )
-            return
-        
-        elif awaiting == 'post_button_text':
-            if not self.is_admin(user.id):
-                return
-            
-            context.user_data['post_button_text'] = text
-            context.user_data['awaiting'] = None
-            
-            # Show list of channels to select
-            if not self.detected_channels:
-                await update.message.reply_text("❌ هیچ کانالی شناسایی نشده است!")
-                context.user_data.clear()
-                return
-            
-            message = "📢 انتخاب کانال برای ارسال پست:\n\n"
-            keyboard = []
-            
-            for chat_id, ch_info in self.detected_channels.items():
-                message += f"• {ch_info['title']} ({chat_id})\n"
-                keyboard.append([InlineKeyboardButton(
-                    f"📢 {ch_info['title']}",
-                    callback_data=f"select_channel_{chat_id}"
-                )])
-            
-            message += "\n👇 روی کانال مورد نظر کلیک کنید:"
-            
-            await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
-            return
-        
-        elif awaiting == 'caption_for_files':
-            if 'temp_files' not in context.user_data or not context.user_data['temp_files']:
-                await update.message.reply_text("❌ خطا: فایلی یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            context.user_data['caption'] = text
-            context.user_data['awaiting'] = 'delete_time'
-            
-            await update.message.reply_text(
-                "⏱️ چه مدت بعد محتوا پاک شود؟\n\n"
-                "لطفاً یک عدد بین 5 تا 30 (ثانیه) وارد کنید:\n\n"
-                "مثال: 10"
-            )
-            return
-        
-        elif awaiting == 'delete_time':
-            if 'temp_files' not in context.user_data or not context.user_data['temp_files']:
-                await update.message.reply_text("❌ خطا: فایلی یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            try:
-                delete_seconds = int(text)
-                if delete_seconds < 5 or delete_seconds > 30:
-                    await update.message.reply_text("❌ لطفاً عددی بین 5 تا 30 وارد کنید.")
-                    return
-            except ValueError:
-                await update.message.reply_text("❌ لطفاً یک عدد معتبر وارد کنید.")
-                return
-            
-            # Generate unique code
-            unique_code = secrets.token_urlsafe(6)
-            
-            # Save file group
-            self.files[unique_code] = {
-                'files': context.user_data['temp_files'],
-                'caption': context.user_data.get('caption'),
-                'delete_seconds': delete_seconds,
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'admin_id': user.id
-            }
-            
-            bot_username = (await self.bot.get_me()).username
-            share_link = f"https://t.me/{bot_username}?start={unique_code}"
-            
-            await update.message.reply_text(
-                f"✅ لینک فایل با موفقیت ساخته شد!\n\n"
-                f"🔗 لینک: {share_link}\n\n"
-                f"📦 تعداد فایل‌ها: {len(context.user_data['temp_files'])}\n"
-                f"📝 متن: {context.user_data.get('caption', 'بدون متن')}\n"
-                f"⏱️ زمان حذف: {delete_seconds} ثانیه\n\n"
-                f"این لینک را برای کاربران ارسال کنید."
-            )
-            
-            context.user_data.clear()
-            logger.info(f"File link created: {unique_code} by admin {user.id}")
-            return
-        
-        elif awaiting == 'channel_link':
-            if not self.is_admin(user.id):
-                return
-            
-            channel_info = self.extract_channel_info(text)
-            
-            if not channel_info:
-                await update.message.reply_text("❌ فرمت نامعتبر! لطفاً دوباره تلاش کنید.")
-                return
-            
-            # Check if bot is admin and get actual chat_id + invite_link
-            is_admin, chat_id, invite_link = await self.check_if_bot_is_admin(channel_info['identifier'])
-            channel_info['can_auto_verify'] = is_admin
-            if chat_id:
-                channel_info['chat_id'] = chat_id
-            if invite_link:
-                channel_info['invite_link'] = invite_link
-            
-            context.user_data['temp_channel'] = channel_info
-            context.user_data['awaiting'] = 'channel_button_text'
-            
-            verify_status = "✅ بات ادمین است (چک خودکار)" if is_admin else "⚠️ بات ادمین نیست (بر اساس اعتماد)"
-            
-            response_text = (
-                f"✅ کانال شناسایی شد!\n\n"
-                f"🔗 {channel_info['display']}\n"
-                f"🔍 {verify_status}\n"
-            )
-            
-            if invite_link:
-                response_text += f"📎 لینک دعوت: {invite_link}\n"
-            
-            response_text += f"\n📝 حالا متن دکمه را وارد کنید:\n\nمثال: عضویت در کانال اصلی"
-            
-            await update.message.reply_text(response_text)
-            return
-        
-        elif awaiting == 'channel_button_text':
-            if not self.is_admin(user.id):
-                return
-            
-            if 'temp_channel' not in context.user_data:
-                await update.message.reply_text("❌ خطا: اطلاعات کانال یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            channel_info = context.user_data['temp_channel']
-            channel_info['button_text'] = text
-            
-            # Save channel - use chat_id as key if available, otherwise identifier
-            channel_key = str(channel_info.get('chat_id') or channel_info['identifier'])
-            self.mandatory_channels[channel_key] = channel_info
-            
-            verify_status = "✅ چک خودکار" if channel_info.get('can_auto_verify') else "🤝 بر اساس اعتماد"
-            
-            response_text = (
-                f"✅ کانال با موفقیت اضافه شد!\n\n"
-                f"📢 متن دکمه: {text}\n"
-                f"🔗 لینک: {channel_info['display']}\n"
-            )
-            
-            if channel_info.get('invite_link'):
-                response_text += f"📎 لینک دعوت: {channel_info['invite_link']}\n"
-            
-            response_text += f"🔍 حالت: {verify_status}\n\nتعداد کانال‌های اجباری: {len(self.mandatory_channels)}"
-            
-            await update.message.reply_text(response_text)
-            
-            context.user_data.clear()
-            logger.info(f"Channel added: {channel_info['display']}")
-            return
-        
-        elif awaiting == 'auto_channel_button_text':
-            if user.id != MAIN_ADMIN_ID:
-                return
-            
-            if 'temp_channel_from_auto' not in context.user_data:
-                await update.message.reply_text("❌ خطا: اطلاعات کانال یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            channel_info = context.user_data['temp_channel_from_auto']
-            channel_info['button_text'] = text
-            channel_info['can_auto_verify'] = True  # Auto-detected channels are always admin
-            
-            # Save to mandatory channels
-            channel_key = str(channel_info['chat_id'])
-            self.mandatory_channels[channel_key] = channel_info
-            
-            response_text = (
-                f"✅ کانال با موفقیت به جوین اجباری اضافه شد!\n\n"
-                f"📢 نام: {channel_info['title']}\n"
-                f"📝 متن دکمه: {text}\n"
-                f"🆔 Chat ID: {channel_info['chat_id']}\n"
-            )
-            
-            if channel_info.get('invite_link'):
-                response_text += f"📎 لینک دعوت: {channel_info['invite_link']}\n"
-            
-            response_text += f"🔍 حالت: چک خودکار ✅\n\nتعداد کانال‌های اجباری: {len(self.mandatory_channels)}"
-            
-            await update.message.reply_text(response_text)
-            
-            context.user_data.clear()
-            logger.info(f"Auto-detected channel added to mandatory: {channel_info['title']}")
-            return
-        
-        elif awaiting == 'target_user_id':
-            if not self.is_admin(user.id):
-                return
-            
-            try:
-                target_user_id = int(text)
-            except ValueError:
-                await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
-                return
-            
-            if target_user_id not in self.users:
-                await update.message.reply_text("❌ این کاربر یافت نشد.")
-                return
-            
-            context.user_data['target_user_id'] = target_user_id
-            context.user_data['awaiting'] = 'pm_message'
-            
-            target_user = self.users[target_user_id]
-            await update.message.reply_text(
-                f"✅ کاربر پیدا شد!\n\n"
-                f"👤 نام: {target_user.get('first_name', 'Unknown')}\n"
-                f"🆔 آیدی: {target_user_id}\n\n"
-                f"📝 حالا پیام خود را ارسال کنید:"
-            )
-            return
-        
-        elif awaiting == 'pm_message':
-            if not self.is_admin(user.id):
-                return
-            
-            if 'target_user_id' not in context.user_data:
-                await update.message.reply_text("❌ خطا: کاربر هدف یافت نشد.")
-                context.user_data.clear()
-                return
-            
-            target_user_id = context.user_data['target_user_id']
-            
-            try:
-                await self.bot.send_message(
-                    chat_id=target_user_id,
-                    text=f"💬 پیام از ادمین:\n\n{text}"
-                )
-                await update.message.reply_text("✅ پیام با موفقیت ارسال شد!")
-            except Forbidden:
-                await self.mark_user_blocked_bot(target_user_id)
-                await update.message.reply_text("❌ کاربر بات را بلاک کرده است.")
-            except Exception as e:
-                logger.error(f"Error sending PM: {e}")
-                await update.message.reply_text("❌ خطا در ارسال پیام.")
-            
-            context.user_data.clear()
-            return
-        
-        elif awaiting == 'block_user_id':
-            if not self.is_admin(user.id):
-                return
-            
-            try:
-                user_id_to_block = int(text)
-            except ValueError:
-                await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
-                return
-            
-            if user_id_to_block not in self.users:
-                await update.message.reply_text("❌ این کاربر یافت نشد.")
-                return
-            
-            self.users[user_id_to_block]['is_blocked'] = True
-            self.users[user_id_to_block]['blocked_at'] = datetime.now(timezone.utc).isoformat()
-            
-            await update.message.reply_text(
-                f"✅ کاربر {user_id_to_block} بلاک شد!\n\n"
-                f"👤 نام: {self.users[user_id_to_block].get('first_name', 'Unknown')}"
-            )
-            
-            context.user_data.clear()
-            logger.info(f"User blocked: {user_id_to_block}")
-            return
-        
-        elif awaiting == 'new_admin_id':
-            if user.id != MAIN_ADMIN_ID:
-                return
-            
-            try:
-                new_admin_id = int(text)
-            except ValueError:
-                await update.message.reply_text("❌ لطفاً یک آیدی عددی معتبر وارد کنید.")
-                return
-            
-            if new_admin_id in self.admins:
-                await update.message.reply_text("❌ این کاربر قبلاً ادمین است.")
-                return
-            
-            self.admins[new_admin_id] = {
-                'added_at': datetime.now(timezone.utc).isoformat(),
-                'added_by': user.id
-            }
-            
-            await update.message.reply_text(
-                f"✅ کاربر {new_admin_id} به عنوان ادمین اضافه شد!\n\n"
-                f"تعداد ادمین‌ها: {len(self.admins)}"
-            )
-            
-            context.user_data.clear()
-            logger.info(f"New admin added: {new_admin_id} by {user.id}")
-            return
+        handler = self._text_handlers.get(context.user_data['awaiting'])
+        if handler:
+            await handler(update, context, user, text)
     
     async def handle_inline_menu_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline menu callbacks"""
         query = update.callback_query
-        await query.answer()
-        
         user = update.effective_user
         data = query.data
         
         if not self.is_admin(user.id):
-            await query.answer("❌ فقط ادمین‌ها دسترسی دارند.", show_alert=True)
+            await self._alert(query, user.id, "❌ فقط ادمین‌ها دسترسی دارند.")
             return
         
+        await query.answer()
+        
         # Users menu
         if data == "menu_active_users":
-            active_users = self.get_active_users()
+            active_count = len(self._active_user_ids)
             
-            if not active_users:
+            if not active_count:
                 await query.edit_message_text("📋 هیچ کاربر فعالی وجود ندارد.")
                 return
             
             # Show ALL users with pagination
-            message = f"👥 کاربران فعال ({len(active_users)} نفر):\n\n"
+            message = f"👥 کاربران فعال ({active_count} نفر):\n\n"
             
-            # Sort by last_seen
-            active_users_sorted = sorted(active_users, key=lambda x: x.get('last_seen', ''), reverse=True)
+            # 50 most recently seen, without sorting or copying every active user
+            recent_users = heapq.nlargest(
+                50, (self.users[user_id] for user_id in self._active_user_ids), key=lambda x: x.last_seen
+            )
             
-            for idx, u in enumerate(active_users_sorted[:50], 1):  # Show first 50
-                last_seen = u.get('last_seen', 'نامشخص')[:16]
-                downloads_count = len(self.get_user_downloads(u['user_id']))
-                message += f"{idx}. {u.get('first_name', 'Unknown')} (@{u.get('username', 'none')})\n"
-                message += f"   🆔 {u['user_id']} | 📥 {downloads_count} دانلود | 🕐 {last_seen}\n\n"
+            # One pass over the download log instead of one per listed user
+            downloads_per_user = Counter(d[1] for d in self.downloads)
+            lines = [message]
+            for idx, u in enumerate(recent_users, 1):
+                last_seen = format_timestamp(u.last_seen)
+                lines.append(
+                    f"{idx}. {u.first_name} (@{u.username})\n"
+                    f"   🆔 {u.user_id} | 📥 {downloads_per_user[u.user_id]} دانلود | 🕐 {last_seen}\n\n"
+                )
             
-            if len(active_users) > 50:
-                message += f"... و {len(active_users) - 50} نفر دیگر\n\n"
+            if active_count > 50:
+                lines.append(f"... و {active_count - 50} نفر دیگر\n\n")
             
-            message += f"📊 مجموع: {len(active_users)} کاربر فعال"
+            lines.append(f"📊 مجموع: {active_count} کاربر فعال")
+            message = "".join(lines)
             
             # Send as multiple messages if too long
             if len(message) > 4000:
@@ -2106,46 +2610,32 @@ class TelegramBot:
         
         elif data == "menu_search_user":
             context.user_data['awaiting'] = 'search_user_id'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
             await query.edit_message_text(
                 "🔍 لطفاً آیدی عددی کاربر را برای جستجو وارد کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CANCEL_MARKUP
             )
             return
         
         elif data == "menu_block_user":
             context.user_data['awaiting'] = 'block_user_id'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
             await query.edit_message_text(
                 "🔨 لطفاً آیدی عددی کاربر برای بلاک کردن را ارسال کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CANCEL_MARKUP
             )
             return
         
         elif data == "menu_unblock_user":
-            blocked_users = [u for u in self.users.values() if u.get('is_blocked', False)]
+            blocked_count = len(self._blocked_user_ids)
             
-            if not blocked_users:
+            if not blocked_count:
                 await query.edit_message_text("📋 هیچ کاربر بلاک شده‌ای وجود ندارد.")
                 return
             
-            message = f"🚫 کاربران بلاک شده ({len(blocked_users)} نفر):\n\n"
-            keyboard = []
-            
-            for u in blocked_users[:20]:
-                username_display = f"@{u.get('username', 'ندارد')}"
-                message += f"• {u.get('first_name', 'Unknown')} ({username_display}) - ID: {u['user_id']}\n"
-                keyboard.append([InlineKeyboardButton(
-                    f"✅ آنبلاک: {u.get('first_name', 'Unknown')} ({u['user_id']})", 
-                    callback_data=f"unblock_{u['user_id']}"
-                )])
-            
-            if len(blocked_users) > 20:
-                message += f"\n... و {len(blocked_users) - 20} نفر دیگر"
-            
-            message += "\n\n👇 روی دکمه کاربر مورد نظر کلیک کنید:"
-            
-            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+            message, reply_markup = self._render_blocked_users(
+                f"🚫 کاربران بلاک شده ({blocked_count} نفر):\n\n",
+                "\n\n👇 روی دکمه کاربر مورد نظر کلیک کنید:"
+            )
+            await query.edit_message_text(message, reply_markup=reply_markup)
             return
         
         # Files menu
@@ -2155,26 +2645,24 @@ class TelegramBot:
                 return
             
             try:
-                bot_username = (await self.bot.get_me()).username
+                bot_username = self.bot_username
                 message_parts = []
                 current_message = f"📋 لیست لینک‌های فایل ({len(self.files)} عدد):\n\n"
+                downloads_per_file = Counter(d[0] for d in self.downloads)
                 
                 for idx, (code, file_info) in enumerate(self.files.items(), 1):
-                    file_count = len(file_info.get('files', []))
-                    caption = file_info.get('caption', 'بدون متن')
+                    file_count = len(file_info.files)
+                    caption = file_info.caption or 'بدون متن'
                     if len(caption) > 30:
                         caption = caption[:30] + "..."
-                    delete_time = file_info.get('delete_seconds', 15)
-                    
-                    # Count downloads for this file
-                    file_downloads = len([d for d in self.downloads if d['file_code'] == code])
+                    delete_time = file_info.delete_seconds
                     
                     file_entry = (
                         f"{idx}. کد: {code}\n"
                         f"   📦 تعداد فایل: {file_count}\n"
                         f"   📝 متن: {caption}\n"
                         f"   ⏱️ زمان حذف: {delete_time}s\n"
-                        f"   📥 دانلود شده: {file_downloads} بار\n"
+                        f"   📥 دانلود شده: {downloads_per_file[code]} بار\n"
                         f"   🔗 https://t.me/{bot_username}?start={code}\n\n"
                     )
                     
@@ -2201,7 +2689,7 @@ class TelegramBot:
                         await self.mark_user_blocked_bot(user.id)
                     
             except Exception as e:
-                logger.error(f"Error in list_files: {e}")
+                logger.error("Error in list_files: %s", e)
                 await query.edit_message_text("❌ خطا در نمایش لیست فایل‌ها.")
             return
         
@@ -2211,47 +2699,30 @@ class TelegramBot:
                 return
             
             try:
-                bot_username = (await self.bot.get_me()).username
-                message = f"🗑 لیست لینک‌های فایل ({len(self.files)} عدد):\n\n"
-                keyboard = []
-                
-                for idx, (code, file_info) in enumerate(self.files.items(), 1):
-                    file_count = len(file_info.get('files', []))
-                    caption = file_info.get('caption', 'بدون متن')
-                    if len(caption) > 20:
-                        caption = caption[:20] + "..."
-                    
-                    message += f"{idx}. {code} ({file_count} فایل)\n"
-                    keyboard.append([InlineKeyboardButton(f"🗑 حذف: {code} - {caption}", callback_data=f"delfile_{code}")])
-                    
-                    if idx >= 15:
-                        message += f"\n... و {len(self.files) - 15} لینک دیگر\n"
-                        break
-                
-                message += "\n👇 روی دکمه لینک مورد نظر کلیک کنید:"
-                
-                await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+                message, reply_markup = self._render_file_delete_menu(
+                    f"🗑 لیست لینک‌های فایل ({len(self.files)} عدد):\n\n",
+                    "\n👇 روی دکمه لینک مورد نظر کلیک کنید:"
+                )
+                await query.edit_message_text(message, reply_markup=reply_markup)
             except Exception as e:
-                logger.error(f"Error in delete file menu: {e}")
+                logger.error("Error in delete file menu: %s", e)
                 await query.edit_message_text("❌ خطا در نمایش لیست فایل‌ها.")
             return
         
         # PM menu
         elif data == "menu_broadcast":
             context.user_data['awaiting'] = 'broadcast_message'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
             await query.edit_message_text(
                 "📢 لطفاً پیامی که می‌خواهید به همه کاربران ارسال شود را بنویسید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CANCEL_MARKUP
             )
             return
         
         elif data == "menu_pm_user":
             context.user_data['awaiting'] = 'target_user_id'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
             await query.edit_message_text(
                 "📩 لطفاً آیدی عددی کاربر را وارد کنید:",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CANCEL_MARKUP
             )
             return
         
@@ -2261,21 +2732,11 @@ class TelegramBot:
                 await query.edit_message_text("📋 هیچ کانال اجباری تنظیم نشده است.")
                 return
             
-            message = f"📢 کانال‌های عضویت اجباری ({len(self.mandatory_channels)} عدد):\n\n"
-            for idx, (ch_key, ch_info) in enumerate(self.mandatory_channels.items(), 1):
-                verify_mode = "✅ چک خودکار" if ch_info.get('can_auto_verify') else "🤝 بر اساس اعتماد"
-                message += f"{idx}. {ch_info['button_text']}\n"
-                message += f"   🔗 {ch_info['display']}\n"
-                if ch_info.get('invite_link'):
-                    message += f"   📎 {ch_info['invite_link']}\n"
-                message += f"   🔍 {verify_mode}\n\n"
-            
-            await query.edit_message_text(message)
+            await query.edit_message_text(self._render_channel_list())
             return
         
         elif data == "menu_add_channel":
             context.user_data['awaiting'] = 'channel_link'
-            keyboard = [[InlineKeyboardButton("❌ لغو", callback_data="cancel_user_send")]]
             await query.edit_message_text(
                 "📢 لینک یا یوزرنیم یا Chat ID کانال را ارسال کنید\n\n"
                 "✅ فرمت‌های قابل قبول:\n"
@@ -2286,7 +2747,7 @@ class TelegramBot:
                 "💡 نکته: بات خودکار تشخیص می‌دهد که ادمین است یا نه.\n"
                 "اگر ادمین باشد، لینک دعوت رو می‌گیره و چک خودکار فعاله.\n"
                 "اگر ادمین نباشد، جوین بر اساس اعتماد به کاربر خواهد بود.",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=CANCEL_MARKUP
             )
             return
         
@@ -2295,17 +2756,11 @@ class TelegramBot:
                 await query.edit_message_text("📋 هیچ کانال اجباری وجود ندارد.")
                 return
             
-            message = "📢 لیست کانال‌ها:\n\n"
-            keyboard = []
-            
-            for idx, (ch_key, ch_info) in enumerate(self.mandatory_channels.items(), 1):
-                message += f"{idx}. {ch_info['button_text']}\n"
-                message += f"   🔗 {ch_info['display']}\n\n"
-                keyboard.append([InlineKeyboardButton(f"🗑 حذف: {ch_info['button_text']}", callback_data=f"delchan_{ch_key}")])
-            
-            message += "👇 روی دکمه کانال مورد نظر کلیک کنید:"
-            
-            await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
+            message, reply_markup = self._render_channel_delete_menu(
+                "📢 لیست کانال‌ها:\n\n",
+                "👇 روی دکمه کانال مورد نظر کلیک کنید:"
+            )
+            await query.edit_message_text(message, reply_markup=reply_markup)
             return
         
         elif data == "menu_detected_channels":
@@ -2342,6 +2797,36 @@ class TelegramBot:
             await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard))
             return
     
+    async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """Log unhandled errors and notice users who blocked the bot"""
+        error = context.error
+        if isinstance(error, Forbidden) and isinstance(update, Update) and update.effective_user:
+            await self.mark_user_blocked_bot(update.effective_user.id)
+            return
+        logger.error("Unhandled error while processing update: %s", error, exc_info=error)
+    
+    async def post_init(self, application: Application):
+        """Start background tasks once the application is initialized"""
+        # Bot.initialize already called getMe, so these are read from its cached User
+        self.bot_username = self.bot.username
+        self._store_writer_task = asyncio.create_task(self._store_writer())
+        self._background_tasks.add(asyncio.create_task(self._expiry_worker()))
+        for _ in range(BROADCAST_WORKERS):
+            self._background_tasks.add(asyncio.create_task(self._broadcast_worker()))
+    
+    async def post_shutdown(self, application: Application):
+        """Stop background tasks before the event loop closes"""
+        tasks = (*self._background_tasks, *self._expiry_batches)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._background_tasks.clear()
+        
+        # Let the store writer drain instead of cancelling it mid-write
+        self._closing = True
+        self._writes_event.set()
+        await self._store_writer_task
+    
     def run(self):
         """Start the bot"""
         # Add handlers in correct order with PRIVATE chat filter
@@ -2351,9 +2836,10 @@ class TelegramBot:
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE, self.handle_text))
         self.application.add_handler(CallbackQueryHandler(self.handle_inline_menu_callback, pattern="^menu_"))
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
+        self.application.add_error_handler(self.error_handler)
         
         logger.info("Bot started successfully!")
-        logger.info(f"Main Admin ID: {MAIN_ADMIN_ID}")
+        logger.info("Main Admin ID: %s", MAIN_ADMIN_ID)
         logger.info("✨ Features:")
         logger.info("  - Auto-detection of channels where bot becomes admin")
         logger.info("  - Force membership recheck on redownload")
@@ -2364,8 +2850,20 @@ class TelegramBot:
         logger.info("  - 📥 Download history tracking per user")
         logger.info("  - 🚫 Auto-removal of users who blocked the bot")
         
-        # Run the bot
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        # Run the bot: Telegram pushes updates to us when a public URL is configured
+        if WEBHOOK_URL:
+            logger.info("Receiving updates via webhook on port %s", PORT)
+            self.application.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+        else:
+            logger.info("Receiving updates via long polling")
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     if not BOT_TOKEN:
@@ -2376,5 +2874,12 @@ if __name__ == "__main__":
         print("❌ Error: MAIN_ADMIN_ID not found in environment variables!")
         exit(1)
     
+    # Faster event loop where available (not supported on Windows)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    
     bot = TelegramBot()
     bot.run()